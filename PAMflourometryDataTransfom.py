@@ -1,10 +1,19 @@
 import os
+import json
+import hashlib
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
-from tailer import tail
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
 from io import StringIO
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import lightCurveFitting
+import pipelineReport
 
 def getCSVfilesList(experimentID, filesIdentifier = ").CSV"):
     """This function gets the experimentID directory, and returns a filtered pandas 
@@ -32,29 +41,181 @@ def extractLocalExperimentID(fileName, experimentID, sep= ","):
     local_ID_list = frame_names.strip("\n").split(sep)
     return local_ID_list
 
-def generateStrippedDataset(fileName, experimentID):
-    """Create a pandas dataframe with only experimental data.
+def parseMetadataLine(line, metadata):
+    """Reads one of the non-data lines of a PAM run file (Type, .par/.lcp names, the Fo/Fm line
+    or the PWS footer) and stores what it describes in the metadata dictionary.
+
+    Args:
+        line (string): A single ";" delimited line from the run file which is not part of the data table.
+        metadata (dict): The dictionary the parsed information should be added to.
+    """
+    # Keep the raw line so nothing the instrument wrote is lost
+    metadata["metadataLines"].append(line)
+    fields = [field.strip() for field in line.split(";")]
+    # The first three fields are always t, Date and Time. Keep the date and time of the first metadata line as the start of the run
+    if (metadata["date"] is None and len(fields) >= 3):
+        metadata["date"] = fields[1]
+        metadata["time"] = fields[2]
+    for field in fields[3:]:
+        if field.startswith("Type:"):
+            metadata["type"] = field[len("Type:"):].strip()
+        elif field.startswith("File:"):
+            metadata["pwsFile"] = field[len("File:"):].strip()
+        elif field.startswith("Fo:"):
+            metadata["Fo"] = float(field[len("Fo:"):])
+        elif field.startswith("Fm:"):
+            metadata["Fm"] = float(field[len("Fm:"):])
+        elif field.endswith(".par"):
+            metadata["parFile"] = field
+        elif field.endswith(".lcp"):
+            metadata["protocolFile"] = field
+
+def readPAMfile(fileName, experimentID, sep=","):
+    """Reads a PAM run file once and splits it into the sample IDs, the metadata lines and the numeric data table.
+    The data table is handed to the C engine of pandas in one block, so the parsing time follows the size of the file.
 
     Args:
         fileName (str): Name of the experiment's .csv file
         experimentID (str): Name of the experiment folder
+        sep (str, optional): The delimiter between the sample names in the first line of the file. Defaults to ",".
 
     Returns:
+        list of strings: A list containing the local names/IDs of the samples. Empty if the file has no sample name line.
+        dict: The run metadata: date, time, type, parFile, protocolFile, Fo, Fm, pwsFile and the raw metadataLines.
         pandas DataFrame: pandas DataFrame containing the PAM experiment data.
     """
-    # Read the experiment file .csv into a pandas dataframe  
-    dataPAM_df = pd.read_csv(f"./{experimentID}/{fileName}", delimiter=";", skiprows=[0,2,3,4,5], skipfooter=1, engine="python")
-    # Drop the first 3 rows as they do not contain experiment data
-    #dataPAM_df = dataPAM_df.drop([0,1,2], axis=0)
-    # Drop the last row as it doesn't contain experimantal data
-    #dataPAM_df = dataPAM_df.iloc[:-1, :]
+    # Read the whole file into memory in one go
+    with open(f"./{experimentID}/{fileName}", "r") as f:
+        text = f.read()
+
+    local_ID_list = []
+    metadata = {"date": None, "time": None, "type": None, "parFile": None, "protocolFile": None, "Fo": None, "Fm": None, "pwsFile": None, "metadataLines": []}
+    headerLine = None
+    # Walk through the lines at the top of the file until the first data row is found
+    position = 0
+    dataStart = len(text)
+    while position < len(text):
+        lineEnd = text.find("\n", position)
+        if lineEnd == -1:
+            lineEnd = len(text)
+        line = text[position:lineEnd].rstrip("\r")
+        if headerLine is None:
+            # The column header is the first line starting with the "t" column, anything before it is the sample name line
+            if line.startswith('"t"'):
+                headerLine = line
+            elif line.strip() != "":
+                local_ID_list = line.split(sep)
+        elif line.count(";") == headerLine.count(";"):
+            # Data rows have exactly as many fields as the header
+            dataStart = position
+            break
+        elif line.strip() != "":
+            parseMetadataLine(line, metadata)
+        position = lineEnd + 1
+
+    if headerLine is None:
+        raise ValueError(f"./{experimentID}/{fileName} does not contain a PAM column header")
+
+    # The footer (File: *.PWS) is the last non-empty line of the file. Runs without data rows (f.ex. Type: ICM) already read it above.
+    dataEnd = len(text)
+    if dataStart < len(text):
+        footerStart = text.rstrip().rfind("\n") + 1
+        if footerStart > dataStart and "File:" in text[footerStart:]:
+            parseMetadataLine(text[footerStart:].strip(), metadata)
+            dataEnd = footerStart
+
+    # Parse the header and the data block with the C engine
+    dataPAM_df = pd.read_csv(StringIO(headerLine + "\n" + text[dataStart:dataEnd]), delimiter=";")
     # Remove all empty columns (columns containing NaN)
     dataPAM_df = dataPAM_df.dropna(axis=1)
-    # Reset the row indexes of the dataframe (start at 0, 1, 2 ...) 
-    dataPAM_df = dataPAM_df.reset_index()
-    
+
+    return local_ID_list, metadata, dataPAM_df
+
+def parseRunTimestamps(dates, times):
+    """Parses the Date and Time columns of run data into timestamps. Values which do not have the instrument's
+    dd.mm.yy hh:mm:ss form (f.ex. a cut off time) become NaT instead of failing every other run.
+
+    Args:
+        dates (pandas Series): The Date column.
+        times (pandas Series): The Time column.
+
+    Returns:
+        pandas Series: The timestamp of each row.
+    """
+    return pd.to_datetime(dates.astype(str) + " " + times.astype(str), format="%d.%m.%y %H:%M:%S", errors="coerce")
+
+def compactRunFrame(dataPAM_df):
+    """Converts run data to the compact form of the merged data: float columns are stored as float32,
+    integer columns in the smallest integer type holding their values (t needs int64), Date as a category, and the
+    Date and Time strings are parsed into a single timestamp column which replaces Time. Frames which are already compact
+    are left as they are. The runs are compacted once after they are concatenated (see concatenateRunFrames), as doing it
+    for every run would cost more than parsing it.
+
+    Args:
+        dataPAM_df (pandas DataFrame): The data table of one or more runs.
+
+    Returns:
+        pandas DataFrame: The compact data table, with a new RangeIndex.
+    """
+    dataPAM_df = dataPAM_df.reset_index(drop=True)
+    compactColumns = {}
+    for column in dataPAM_df.columns:
+        values = dataPAM_df[column]
+        if pd.api.types.is_float_dtype(values) and values.dtype != np.float32:
+            compactColumns[column] = values.astype(np.float32)
+        elif pd.api.types.is_integer_dtype(values):
+            compactColumns[column] = pd.to_numeric(values, downcast="integer")
+        elif column == "Time" and "Date" in dataPAM_df.columns:
+            # The start of each row, parsed once so nobody has to compare date and time strings
+            compactColumns["timestamp"] = parseRunTimestamps(dataPAM_df["Date"], values)
+        elif column == "Date" and not isinstance(values.dtype, pd.CategoricalDtype):
+            # A run only has one or two different dates, so each row only needs a small category code
+            compactColumns[column] = values.astype("category")
+        else:
+            compactColumns[column] = values
+    return pd.DataFrame(compactColumns)
+
+def generateStrippedDataset(fileName, experimentID):
+    """Create a pandas dataframe with only experimental data.
+
+    Args:
+        fileName (str): Name of the experiment's .csv file
+        experimentID (str): Name of the experiment folder
+
+    Returns:
+        pandas DataFrame: pandas DataFrame containing the PAM experiment data.
+    """
+    # Read the experiment file and keep only the data table
+    local_ID_list, metadata, dataPAM_df = readPAMfile(fileName, experimentID)
+
     return dataPAM_df
 
+def injectCalculatedValues(PAMdata_df, max_Fm, max_Fo):
+    """Calculates NPQown, PSII\', qP, and rETR from the given max Fm and max Fo and places them in new columns of the dataframe.
+
+    Args:
+        PAMdata_df (pandas DataFrame): A pandas Dataframe containing the PAM fluorometry data.
+        max_Fm (float): The highest Fm' of the run.
+        max_Fo (float): The highest ~Fo' of the run.
+
+    Returns:
+        pandas DataFrame: A pandas DataFrame containing the original data along with: NPQown, PSII\', qP, and rETR.
+    """
+    # The values are calculated in double precision and stored as float32 like the rest of the run
+    Fm_prime = PAMdata_df["Fm\'"].to_numpy(dtype=np.float64)
+    max_Fm = np.float64(max_Fm)
+    max_Fo = np.float64(max_Fo)
+    # Calculate NPQown maxFm/Fm'-1 and place it in a new column "NPQown"
+    PAMdata_df['NPQown'] = ((max_Fm/Fm_prime)-1).astype(np.float32)
+    # Calculate phi PSII' and place it in new column "PSII\'"
+    PSII_prime = ((Fm_prime - max_Fo)/Fm_prime)
+    PAMdata_df['PSII\''] = PSII_prime.astype(np.float32)
+    # Calculate qP 
+    PAMdata_df['qP'] = ((Fm_prime - max_Fm) / (Fm_prime - max_Fo)).astype(np.float32)
+    # Calculate rETR = PSII*PAR
+    PAMdata_df['rETR'] = (PSII_prime * PAMdata_df['PAR'].to_numpy(dtype=np.float64)).astype(np.float32)
+    return PAMdata_df
+
 def calculateValuesAndInject(PAMdata_df, local_ID_list):
     """Takes in a dataframe of PAM fluorometry data and calculates NPQown, PSII\',
     qP, and rETR. Returns a dataframe containing the calculated values along with 
@@ -68,26 +229,506 @@ def calculateValuesAndInject(PAMdata_df, local_ID_list):
         pandas Series: A pandas Series containing the maximal valuse in the Dataframe for: Fm, NPQ, Fo, and PSII.
     """
     # Find max Fm
-    max_Fm = PAMdata_df["Fm'"].max()
-    # Calculate NPQown maxFm/Fm'-1 and place it in a new column "NPQown"
-    PAMdata_df['NPQown'] = (max_Fm/PAMdata_df["Fm\'"])-1
+    max_Fm = np.float64(PAMdata_df["Fm'"].max())
+    # Find max Fo
+    max_Fo = np.float64(PAMdata_df["~Fo'"].max())
+    # Calculate NPQown, PSII', qP and rETR and place them in new columns
+    PAMdata_df = injectCalculatedValues(PAMdata_df, max_Fm, max_Fo)
     # Find max NPQ
     max_NPQ = PAMdata_df["NPQown"].max()
-    # Find max Fo
-    max_Fo = PAMdata_df["~Fo'"].max()
     # Calculate phi PSIImax
     max_PSII = ((max_Fm - max_Fo)/max_Fm)
-    # Calculate phi PSII' and place it in new column "PSII\'"
-    PAMdata_df['PSII\''] = ((PAMdata_df["Fm\'"] - max_Fo)/PAMdata_df["Fm\'"])
-    # Calculate qP 
-    PAMdata_df['qP'] = ((PAMdata_df["Fm\'"] - max_Fm) / (PAMdata_df["Fm\'"] - max_Fo))
-    # Calculate rETR = PSII*PAR
-    PAMdata_df['rETR'] = PAMdata_df['PSII\''] * PAMdata_df['PAR']
-    # Create a series of max values
-    maxValues_Series = pd.Series([max_Fm, max_NPQ, max_Fo, max_PSII], index=["max_Fm", "max_NPQ", "max_Fo", "max_PSII"], name=", ".join(local_ID_list))
+    # Create a series of max values, stored as float32 like the data they come from
+    maxValues_Series = pd.Series([max_Fm, max_NPQ, max_Fo, max_PSII], index=["max_Fm", "max_NPQ", "max_Fo", "max_PSII"], name=", ".join(local_ID_list), dtype=np.float32)
 
     return PAMdata_df, maxValues_Series
 
+def calculateValuesFromArrays(Fm_prime, Fo_prime, PAR, runOffsets):
+    """Calculates NPQown, PSII\', qP, and rETR for many runs at once. The runs are stacked after each other in the arrays,
+    and runOffsets gives the index of the first row of each run. The max values of each run are found with reductions
+    over the run segments, so the calculation is done in one vectorized pass no matter how many runs there are.
+
+    Args:
+        Fm_prime (numpy array): The Fm' of every row of every run.
+        Fo_prime (numpy array): The ~Fo' of every row of every run.
+        PAR (numpy array): The PAR of every row of every run.
+        runOffsets (numpy array of ints): The index of the first row of each run, in increasing order.
+
+    Returns:
+        dict of numpy arrays: NPQown, PSII', qP and rETR for every row.
+        dict of numpy arrays: max_Fm, max_NPQ, max_Fo and max_PSII for every run. Runs without rows get NaN.
+    """
+    Fm_prime = np.asarray(Fm_prime, dtype=np.float64)
+    Fo_prime = np.asarray(Fo_prime, dtype=np.float64)
+    PAR = np.asarray(PAR, dtype=np.float64)
+    runOffsets = np.asarray(runOffsets, dtype=np.int64)
+    # The number of rows in each run
+    runLengths = np.diff(np.append(runOffsets, len(Fm_prime)))
+    hasRows = runLengths > 0
+
+    def maxPerRun(values):
+        # fmax ignores NaN like pandas max does. reduceat can only be given the offsets of runs with rows
+        runMax = np.full(len(runOffsets), np.nan)
+        if hasRows.any():
+            runMax[hasRows] = np.fmax.reduceat(values, runOffsets[hasRows])
+        return runMax
+
+    # Find max Fm and max Fo of each run and spread them out over the rows of the run
+    max_Fm = maxPerRun(Fm_prime)
+    max_Fo = maxPerRun(Fo_prime)
+    max_Fm_rows = np.repeat(max_Fm, runLengths)
+    max_Fo_rows = np.repeat(max_Fo, runLengths)
+    # Calculate NPQown, PSII', qP and rETR for all rows
+    NPQown = (max_Fm_rows/Fm_prime)-1
+    PSII_prime = (Fm_prime - max_Fo_rows)/Fm_prime
+    qP = (Fm_prime - max_Fm_rows) / (Fm_prime - max_Fo_rows)
+    rETR = PSII_prime * PAR
+    # Find max NPQ and calculate phi PSIImax of each run
+    max_NPQ = maxPerRun(NPQown)
+    max_PSII = (max_Fm - max_Fo)/max_Fm
+
+    calculatedValues = {"NPQown": NPQown, "PSII'": PSII_prime, "qP": qP, "rETR": rETR}
+    maxValues = {"max_Fm": max_Fm, "max_NPQ": max_NPQ, "max_Fo": max_Fo, "max_PSII": max_PSII}
+    return calculatedValues, maxValues
+
+def calculateValuesBatch(PAMdata_df, runOffsets, runNames):
+    """Takes in one long dataframe holding many runs after each other and calculates NPQown, PSII\', qP, and rETR for all of them
+    in one pass. Gives the same values as calling calculateValuesAndInject on each run, without the pandas overhead per run.
+
+    Args:
+        PAMdata_df (pandas DataFrame): A pandas Dataframe containing the PAM fluorometry data of all runs, one run after the other.
+        runOffsets (list of ints): The row number of the first row of each run, in increasing order.
+        runNames (list of strings): The name of each run, used as row names of the max values.
+
+    Returns:
+        pandas DataFrame: A pandas DataFrame containing the original data along with: NPQown, PSII\', qP, and rETR.
+        pandas DataFrame: The max values (max_Fm, max_NPQ, max_Fo, max_PSII) of each run, with the run names as row names.
+    """
+    calculatedValues, maxValues = calculateValuesFromArrays(PAMdata_df["Fm'"].to_numpy(), PAMdata_df["~Fo'"].to_numpy(), PAMdata_df["PAR"].to_numpy(), runOffsets)
+    # Add all calculated columns in one step, stored as float32 like the rest of the data
+    PAMdata_df = PAMdata_df.assign(**{column: values.astype(np.float32) for column, values in calculatedValues.items()})
+    maxValues_df = pd.DataFrame(maxValues, index=pd.Index(runNames)).astype(np.float32)
+    return PAMdata_df, maxValues_df
+
+def processPAMfile(fileName, experimentID):
+    """Reads a single PAM run file and calculates its values. Kept at module level so it can be sent to worker processes.
+
+    Args:
+        fileName (str): Name of the experiment's .csv file
+        experimentID (str): Name of the experiment folder
+
+    Returns:
+        list of strings: A list containing the local names/IDs of the samples.
+        pandas DataFrame: A pandas DataFrame containing the original data along with: NPQown, PSII\', qP, and rETR.
+        pandas Series: A pandas Series containing the maximal valuse in the Dataframe for: Fm, NPQ, Fo, and PSII.
+
+    Raises:
+        ValueError: If the data fails checkRunFrame, with the reason as the message.
+    """
+    listOfSampleNames, calculatedPAMdata_df, calculatedValuesSeries, runMetadata = processPAMfileWithMetadata(fileName, experimentID)
+    return listOfSampleNames, calculatedPAMdata_df, calculatedValuesSeries
+
+def processPAMfileWithMetadata(fileName, experimentID):
+    """Does the same as processPAMfile and also returns the metadata of the run (see readPAMfile), which the run cache keeps for the experiment store.
+
+    Returns:
+        The same as processPAMfile, followed by the metadata dictionary of the run.
+
+    Raises:
+        ValueError: If the data fails checkRunFrame, with the reason as the message.
+    """
+    listOfSampleNames, runMetadata, strippedPAMdata_df = readPAMfile(fileName, experimentID)
+    # Check the data before calculating, the calculation would fail on a missing column without saying why
+    failureReason = checkRunFrame(strippedPAMdata_df)
+    if failureReason is not None:
+        raise ValueError(failureReason)
+    calculatedPAMdata_df, calculatedValuesSeries = calculateValuesAndInject(strippedPAMdata_df, listOfSampleNames)
+    return listOfSampleNames, calculatedPAMdata_df, calculatedValuesSeries, runMetadata
+
+# The columns every run needs for the calculated values, the merge and the group statistics
+requiredRunColumns = ["t", "No.", "PAR", "Fm'", "~Fo'"]
+
+def checkPAMfileSchema(fileName, experimentID):
+    """Checks the top of a PAM run file without parsing its data table: the file must have a column header holding all
+    requiredRunColumns and at least one data row. Only the lines up to the first data row are read, so this is cheap even for large files.
+
+    Args:
+        fileName (str): Name of the experiment's .csv file
+        experimentID (str): Name of the experiment folder
+
+    Returns:
+        string: Why the file can not be processed, or None if it passed the check.
+    """
+    try:
+        with open(f"./{experimentID}/{fileName}", "r") as f:
+            headerLine = None
+            for line in f:
+                line = line.rstrip("\r\n")
+                if headerLine is None:
+                    if line.startswith('"t"'):
+                        headerLine = line
+                        headerColumns = [column.strip('"') for column in headerLine.split(";")]
+                        missingColumns = [column for column in requiredRunColumns if column not in headerColumns]
+                        if missingColumns:
+                            return f"the header is missing the column(s) {', '.join(missingColumns)}"
+                elif line.count(";") == headerLine.count(";"):
+                    # The first data row, the rest of the file is checked when it is parsed
+                    return None
+    except (OSError, UnicodeDecodeError) as error:
+        return f"the file can not be read ({error})"
+    if headerLine is None:
+        return "the file does not contain a PAM column header"
+    return "the run has no data rows"
+
+def checkRunFrame(dataPAM_df):
+    """Checks the parsed data table of a run. Rows cut off by an interrupted write leave empty fields, which makes
+    readPAMfile drop the whole column, so a file can pass checkPAMfileSchema and still miss required columns here.
+
+    Args:
+        dataPAM_df (pandas DataFrame): The data table from readPAMfile.
+
+    Returns:
+        string: Why the run can not be processed, or None if it passed the check.
+    """
+    missingColumns = [column for column in requiredRunColumns if column not in dataPAM_df.columns]
+    if missingColumns:
+        return f"the data is missing the column(s) {', '.join(missingColumns)} (empty or cut off rows)"
+    if len(dataPAM_df) == 0:
+        return "the run has no data rows"
+    nonNumericColumns = [column for column in requiredRunColumns if not pd.api.types.is_numeric_dtype(dataPAM_df[column])]
+    if nonNumericColumns:
+        return f"the column(s) {', '.join(nonNumericColumns)} hold values which are not numbers"
+    if "Date" in dataPAM_df.columns and "Time" in dataPAM_df.columns:
+        unreadableRows = parseRunTimestamps(dataPAM_df["Date"], dataPAM_df["Time"]).isna()
+        if unreadableRows.any():
+            firstRow = dataPAM_df.loc[unreadableRows].iloc[0]
+            return f"the Date/Time of {unreadableRows.sum()} row(s) can not be read (f.ex. {firstRow['Date']} {firstRow['Time']})"
+    return None
+
+def checkedFileFunction(fileFunction, fileName, experimentID):
+    """Calls fileFunction(fileName, experimentID) and checks the run data it returns, giving the reason instead of raising when the file fails.
+    Kept at module level so it can run in worker processes (as functools.partial(checkedFileFunction, fileFunction)).
+
+    Returns:
+        The result of fileFunction, or None if the file failed.
+        string: Why the file failed, or None if it passed.
+    """
+    try:
+        result = fileFunction(fileName, experimentID)
+    except KeyError as error:
+        return None, f"the data is missing the column {error}"
+    except ValueError as error:
+        # The file functions raise ValueError with the reason, f.ex. processPAMfile for data failing checkRunFrame
+        return None, str(error)
+    except Exception as error:
+        # Any error only concerns this file, the other files can still be merged
+        return None, f"{type(error).__name__}: {error}"
+    runFrame = next((item for item in result if isinstance(item, pd.DataFrame)), None)
+    failureReason = None if runFrame is None else checkRunFrame(runFrame)
+    if failureReason is not None:
+        return None, failureReason
+    return result, None
+
+def quarantineFile(quarantine, fileName, experimentID, failureReason, report=None):
+    """Leaves a file which failed its checks out of the processing: it is added to the quarantine with the reason, and to the report if one is given.
+
+    Args:
+        quarantine (dict): The quarantined files of the experiment, file name to reason.
+        fileName (string): The name of the run file.
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+        failureReason (string): Why the file failed.
+        report (dict, optional): A report from pipelineReport.newPipelineReport. Defaults to None.
+    """
+    print(f"Skipping {experimentID}/{fileName}: {failureReason}")
+    quarantine[fileName] = failureReason
+    if report is not None:
+        pipelineReport.recordQuarantinedFile(report, {"fileName": fileName, "experimentID": experimentID, "reason": failureReason})
+
+def writeQuarantineList(quarantinePath, experimentID, quarantine):
+    """Saves the quarantined files of an experiment with their reasons as JSON, or removes the list of an earlier merge when no file was quarantined.
+
+    Args:
+        quarantinePath (string): The JSON file to write.
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+        quarantine (dict): The quarantined files of the experiment, file name to reason.
+    """
+    if not quarantine:
+        if os.path.exists(quarantinePath):
+            os.remove(quarantinePath)
+        return
+    with open(quarantinePath, "w") as f:
+        json.dump({"experimentID": experimentID, "files": dict(sorted(quarantine.items()))}, f, indent=1)
+
+def saveQuarantineList(experimentID, quarantine):
+    """Saves the quarantined files of an experiment as myPAMresults/<experiment name>_quarantine.json (see writeQuarantineList).
+    Call it before checkRunsLeft, so the list is also saved when every file of the experiment was quarantined.
+
+    Args:
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+        quarantine (dict): The quarantined files of the experiment, or None if bad files were not skipped, in which case nothing is saved.
+    """
+    if quarantine is None:
+        return
+    createDirectoryIfNotPresent("./myPAMresults")
+    writeQuarantineList(f"./myPAMresults/{os.path.basename(os.path.normpath(experimentID))}_quarantine.json", experimentID, quarantine)
+
+def checkRunsLeft(experimentID, runCount, quarantine):
+    """Raises a ValueError naming the experiment when every run file was quarantined, as there is nothing left to merge or plot.
+
+    Args:
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+        runCount (int): The number of runs which were not quarantined.
+        quarantine (dict): The quarantined files of the experiment, or None.
+    """
+    if quarantine and runCount == 0:
+        raise ValueError(f"None of the {len(quarantine)} run files of {experimentID} can be processed")
+
+def mapFiles(fileFunction, fileNames, experimentID, workers=1, report=None, quarantine=None, executor=None):
+    """Calls fileFunction(fileName, experimentID) for each of the given files, optionally in a pool of worker processes.
+
+    Args:
+        fileFunction (function): A module level function taking a file name and the experimentID.
+        fileNames (list of strings): The names of the run files.
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+        workers (int, optional): The number of worker processes to use. 1 processes the files in the current process. Defaults to 1.
+        report (dict, optional): A report from pipelineReport.newPipelineReport, which gets the time, size and rows of each file as it finishes. Defaults to None.
+        quarantine (dict, optional): If given, files which fail checkPAMfileSchema before processing or raise or fail checkRunFrame while processing
+            are added to it (see quarantineFile) and left out of the results, instead of stopping all files. Defaults to None.
+        executor (concurrent.futures.Executor, optional): A process pool shared by several calls, used instead of starting a pool of workers for these files. Defaults to None.
+
+    Returns:
+        list: The result for each file, in the same order as fileNames. With a quarantine only the files which were not quarantined have a result.
+    """
+    if quarantine is not None:
+        # Check the header of each file before starting on the data, so files which can not work are never parsed
+        checkedFileNames = []
+        for fileName in fileNames:
+            failureReason = checkPAMfileSchema(fileName, experimentID)
+            if failureReason is None:
+                checkedFileNames.append(fileName)
+            else:
+                quarantineFile(quarantine, fileName, experimentID, failureReason, report)
+        checkedResults = mapFiles(partial(checkedFileFunction, fileFunction), checkedFileNames, experimentID, workers=workers, report=report, executor=executor)
+        results = []
+        for fileName, (result, failureReason) in zip(checkedFileNames, checkedResults):
+            if failureReason is None:
+                results.append(result)
+            else:
+                quarantineFile(quarantine, fileName, experimentID, failureReason, report)
+        return results
+
+    if report is not None:
+        # Each file is measured where it is processed, which may be a worker process
+        fileFunction = partial(pipelineReport.measureFileFunction, fileFunction)
+
+    def collectResults(mappedResults):
+        if report is None:
+            return list(mappedResults)
+        results = []
+        for result, fileEntry in mappedResults:
+            pipelineReport.recordFile(report, fileEntry)
+            results.append(result)
+        return results
+
+    # With a single worker (or a single file) there is nothing to gain from starting processes
+    if ((executor is None and workers <= 1) or len(fileNames) <= 1):
+        return collectResults(fileFunction(fileName, experimentID) for fileName in fileNames)
+    # Executor.map returns the results in the order the files were handed in, regardless of which worker finishes first
+    chunksize = max(1, len(fileNames)//(max(workers, 1)*4))
+    if executor is not None:
+        return collectResults(executor.map(fileFunction, fileNames, [experimentID]*len(fileNames), chunksize=chunksize))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return collectResults(executor.map(fileFunction, fileNames, [experimentID]*len(fileNames), chunksize=chunksize))
+
+def processFiles(fileNames, experimentID, workers=1, report=None, quarantine=None, executor=None):
+    """Reads and calculates the given run files, optionally in a pool of worker processes.
+
+    Args:
+        fileNames (list of strings): The names of the run files to process.
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+        workers (int, optional): The number of worker processes to use. 1 processes the files in the current process. Defaults to 1.
+        report (dict, optional): A report from pipelineReport.newPipelineReport which gets the measurements of each file. Defaults to None.
+        quarantine (dict, optional): If given, files which fail are added to it and left out instead of raising (see mapFiles). Defaults to None.
+        executor (concurrent.futures.Executor, optional): A process pool shared by several calls, used instead of starting a pool of workers for these files. Defaults to None.
+
+    Returns:
+        list of tuples: One (listOfSampleNames, calculatedPAMdata_df, calculatedValuesSeries) tuple per file which was not quarantined, in the same order as fileNames.
+    """
+    return mapFiles(processPAMfile, fileNames, experimentID, workers=workers, report=report, quarantine=quarantine, executor=executor)
+
+def getFileFingerprint(filePath):
+    """Returns the size and modification time of a file, used to tell cheaply whether a cached run is still valid.
+
+    Args:
+        filePath (string): The path of the file.
+
+    Returns:
+        dict: The size (bytes) and mtime (nanoseconds) of the file.
+    """
+    fileStats = os.stat(filePath)
+    return {"size": fileStats.st_size, "mtime": fileStats.st_mtime_ns}
+
+def getFileHash(filePath):
+    """Returns the SHA-1 hash of the content of a file.
+
+    Args:
+        filePath (string): The path of the file.
+
+    Returns:
+        string: The hexadecimal SHA-1 hash of the file.
+    """
+    with open(filePath, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def getExperimentFingerprint(experimentID):
+    """Returns a hash of the names, sizes and modification times of the run files in the experiment directory,
+    which changes whenever a run file is added, removed or changed.
+
+    Args:
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+
+    Returns:
+        string: The hexadecimal SHA-1 hash of the file fingerprints.
+    """
+    fileNamesSeries, experimentPath = getCSVfilesList(experimentID)
+    fileFingerprints = {fileName: getFileFingerprint(f"{experimentPath}{fileName}") for fileName in sorted(fileNamesSeries)}
+    return hashlib.sha1(json.dumps(fileFingerprints, sort_keys=True).encode()).hexdigest()
+
+# The version of the cached run files, increased whenever the form of the processed runs changes
+runCacheFormat = 4
+# The number of new or changed files processed between saves of the cache index, so an interrupted merge only loses the files since the last save
+runCacheCheckpointFiles = 200
+
+def loadRunCacheIndex(cacheDirectory):
+    """Loads the index of a run cache directory, or an empty index if the cache does not exist yet.
+
+    Args:
+        cacheDirectory (string): The directory holding the run cache.
+
+    Returns:
+        dict: For each cached file name its size, mtime, hash, cache format and the name of the cached run file.
+    """
+    indexPath = f"{cacheDirectory}/index.json"
+    if not os.path.exists(indexPath):
+        return {}
+    with open(indexPath, "r") as f:
+        return json.load(f)
+
+def saveRunCacheIndex(cacheDirectory, cacheIndex):
+    """Saves the index of a run cache directory. The index is written to a temporary file first so an interrupted write can not corrupt it.
+
+    Args:
+        cacheDirectory (string): The directory holding the run cache.
+        cacheIndex (dict): The index as returned by loadRunCacheIndex.
+    """
+    indexPath = f"{cacheDirectory}/index.json"
+    with open(indexPath + ".tmp", "w") as f:
+        json.dump(cacheIndex, f, indent=1)
+    os.replace(indexPath + ".tmp", indexPath)
+
+def processExperimentFilesCached(experimentID, cacheDirectory, workers=1, report=None, quarantine=None, executor=None, runInfo=None):
+    """Reads and calculates the run files in the experiment directory, reusing the results of files that are unchanged since the last call.
+    A file counts as unchanged if its size and modification time match the cache, or, if only the modification time changed, its content hash does.
+    Only new and changed files are processed, after which the cache is updated and the entries of removed files are dropped.
+    The index is also saved after every runCacheCheckpointFiles processed files, so an interrupted call continues from there the next time.
+
+    Args:
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+        cacheDirectory (string): The directory holding the run cache.
+        workers (int, optional): The number of worker processes used for the new and changed files. Defaults to 1.
+        report (dict, optional): A report from pipelineReport.newPipelineReport which gets the measurements of each processed file. Defaults to None.
+        quarantine (dict, optional): If given, files which fail are added to it and left out instead of raising (see mapFiles).
+            The reason is cached too, so an unchanged file which failed before is not read again. Defaults to None.
+        executor (concurrent.futures.Executor, optional): A process pool shared by several calls, used instead of starting a pool of workers for these files. Defaults to None.
+        runInfo (list, optional): If given, a (fileName, runMetadata) tuple is appended to it for every returned run. Defaults to None.
+
+    Returns:
+        list of tuples: One (listOfSampleNames, calculatedPAMdata_df, calculatedValuesSeries) tuple per file which was not quarantined, in the same order as getCSVfilesList.
+    """
+    createDirectoryIfNotPresent(cacheDirectory)
+    cacheIndex = loadRunCacheIndex(cacheDirectory)
+    fileNamesSeries, experimentPath = getCSVfilesList(experimentID)
+    fileNames = list(fileNamesSeries)
+
+    processedRuns = {}
+    fileEntries = {}
+    filesToProcess = []
+    for fileName in fileNames:
+        filePath = f"{experimentPath}{fileName}"
+        entry = getFileFingerprint(filePath)
+        entry["format"] = runCacheFormat
+        cachedEntry = cacheIndex.get(fileName)
+        # Runs cached in an older form (f.ex. compacted runs, which can not be concatenated with the runs read now) are processed again
+        if cachedEntry is not None and cachedEntry.get("format") == runCacheFormat and cachedEntry["size"] == entry["size"]:
+            # Same size and modification time: the cached run is valid without reading the file
+            if cachedEntry["mtime"] == entry["mtime"]:
+                entry["hash"] = cachedEntry["hash"]
+            else:
+                entry["hash"] = getFileHash(filePath)
+            if entry["hash"] == cachedEntry["hash"]:
+                # Files which failed before only stay quarantined when quarantining, otherwise they are processed again and raise
+                if "failure" in cachedEntry and quarantine is not None:
+                    entry["failure"] = cachedEntry["failure"]
+                    quarantineFile(quarantine, fileName, experimentID, entry["failure"], report)
+                    fileEntries[fileName] = entry
+                    continue
+                if "runFile" in cachedEntry and os.path.exists(f"{cacheDirectory}/{cachedEntry['runFile']}"):
+                    entry["runFile"] = cachedEntry["runFile"]
+                    processedRuns[fileName] = pd.read_pickle(f"{cacheDirectory}/{cachedEntry['runFile']}")
+                    fileEntries[fileName] = entry
+                    continue
+        filesToProcess.append((fileName, entry))
+
+    # Process the new and changed files in parts, storing each part in the cache before starting on the next
+    for partStart in range(0, len(filesToProcess), runCacheCheckpointFiles):
+        filesInPart = filesToProcess[partStart:partStart + runCacheCheckpointFiles]
+        newRuns = iter(mapFiles(processPAMfileWithMetadata, [fileName for fileName, entry in filesInPart], experimentID, workers=workers, report=report, quarantine=quarantine, executor=executor))
+        for fileName, entry in filesInPart:
+            if "hash" not in entry:
+                entry["hash"] = getFileHash(f"{experimentPath}{fileName}")
+            if quarantine is not None and fileName in quarantine:
+                entry["failure"] = quarantine[fileName]
+            else:
+                processedRun = next(newRuns)
+                entry["runFile"] = f"{entry['hash']}.pkl"
+                pd.to_pickle(processedRun, f"{cacheDirectory}/{entry['runFile']}")
+                processedRuns[fileName] = processedRun
+            fileEntries[fileName] = entry
+        # The entries of the files not processed yet are kept as they were
+        saveRunCacheIndex(cacheDirectory, {**cacheIndex, **fileEntries})
+
+    # Remove the cached runs which are no longer used by any file
+    usedRunFiles = {entry["runFile"] for entry in fileEntries.values() if "runFile" in entry}
+    for cachedEntry in cacheIndex.values():
+        if "runFile" in cachedEntry and cachedEntry["runFile"] not in usedRunFiles and os.path.exists(f"{cacheDirectory}/{cachedEntry['runFile']}"):
+            os.remove(f"{cacheDirectory}/{cachedEntry['runFile']}")
+    saveRunCacheIndex(cacheDirectory, fileEntries)
+
+    # The cached runs hold the metadata of the run after the processed run
+    keptFileNames = [fileName for fileName in fileNames if fileName in processedRuns]
+    if runInfo is not None:
+        runInfo.extend((fileName, processedRuns[fileName][3]) for fileName in keptFileNames)
+    return [processedRuns[fileName][:3] for fileName in keptFileNames]
+
+def processExperimentFiles(experimentID, workers=1, cacheDirectory=None, report=None, quarantine=None, executor=None):
+    """Reads and calculates all the run files in the experiment directory, optionally in a pool of worker processes.
+
+    Args:
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+        workers (int, optional): The number of worker processes to use. 1 processes the files in the current process. Defaults to 1.
+        cacheDirectory (string, optional): If given, unchanged files are loaded from this run cache instead of being processed again. Defaults to None.
+        report (dict, optional): A report from pipelineReport.newPipelineReport which gets the measurements of each processed file. Defaults to None.
+        quarantine (dict, optional): If given, files which fail are added to it and left out instead of raising (see mapFiles). Defaults to None.
+        executor (concurrent.futures.Executor, optional): A process pool shared by several calls, used instead of starting a pool of workers for these files. Defaults to None.
+
+    Returns:
+        list of tuples: One (listOfSampleNames, calculatedPAMdata_df, calculatedValuesSeries) tuple per file which was not quarantined, in the same order as getCSVfilesList.
+    """
+    if cacheDirectory is not None:
+        return processExperimentFilesCached(experimentID, cacheDirectory, workers=workers, report=report, quarantine=quarantine, executor=executor)
+    fileNamesSeries, experimentPath = getCSVfilesList(experimentID)
+    return processFiles(list(fileNamesSeries), experimentID, workers=workers, report=report, quarantine=quarantine, executor=executor)
+
 def accessAxes(ax, x_axes, y_axes, x, y):
     """ This function returns the axes (subplot) indicated by the x and y coordinates of a plot.
 
@@ -158,7 +799,7 @@ def plotPAMdata(PAMdata_df, local_ID_list, mpl_ax=None, x_axis = ["t"], y_axis =
             # Make an integer which keeps track of which color should be plotted for each graph
             colorInt = 0
             # List of iteratable colors for plots
-            colorList = ['blue', 'red', 'green', 'magenta', 'yellow', 'blacl', 'white']
+            colorList = ['blue', 'red', 'green', 'magenta', 'yellow', 'black', 'white']
             
             # Gains access to the axes (the subfigures) and sets the x and y axis labels based on the labels given in x_axis and y_axis
             accessAxes(ax, x_axis, y_axis, i, j).set_xlabel(x_axis[i])
@@ -192,6 +833,182 @@ def plotPAMdata(PAMdata_df, local_ID_list, mpl_ax=None, x_axis = ["t"], y_axis =
 
     return ax, legendList
 
+def groupRunsByTag(sampleNamesPerRun, wildtypeTag = "WT", sampleTags = ["LHCX1g1", "LHCX1g2"]):
+    """Sorts the runs into the plot groups used by plotPAMdata: runs with a sample name containing the wildtype tag, and
+    runs with a sample name containing each of the sample tags. A run can be part of more than one group.
+
+    Args:
+        sampleNamesPerRun (list of lists of strings): The sample names of each run.
+        wildtypeTag (string, optional): A part of each WT sample name which allows them to be grouped. Defaults to "WT"
+        sampleTags (list of strings, optional): A part of each sample name to uniquely identify which samples should be grouped. Defaults to ["LHCX1g1", "LHCX1g2"]
+
+    Returns:
+        list of tuples: One (tag, color, list of run numbers) tuple for each group, in the order the groups are drawn and listed in the legend.
+    """
+    # List of iteratable colors for plots, the same as in plotPAMdata
+    colorList = ['blue', 'red', 'green', 'magenta', 'yellow', 'black', 'white']
+    groups = [(wildtypeTag, "cyan", [runNumber for runNumber, local_ID_list in enumerate(sampleNamesPerRun) if any(wildtypeTag in string for string in local_ID_list)])]
+    for colorInt, sampleTag in enumerate(sampleTags):
+        groups.append((sampleTag, colorList[colorInt % len(colorList)], [runNumber for runNumber, local_ID_list in enumerate(sampleNamesPerRun) if any(sampleTag in string for string in local_ID_list)]))
+    return groups
+
+def aggregateGroupStatistics(mainOut_df, wildtypeTag = "WT", sampleTags = ["LHCX1g1", "LHCX1g2"], alignOn = "No.", valueColumns = ["NPQown", "rETR", "qP", "PSII'"], timeResolution = 1.0, runOffsets = None):
+    """Calculates the mean, standard deviation (SD), standard error (SE) and number of runs (n) of each plot group (see groupRunsByTag)
+    at every step of the runs. All groups and steps are calculated with one grouped aggregation instead of a loop over the runs.
+
+    Args:
+        mainOut_df (pandas DataFrame): The main data as made by mergeData, with the sampleName column.
+        wildtypeTag (string, optional): A part of each WT sample name which allows them to be grouped. Defaults to "WT"
+        sampleTags (list of strings, optional): A part of each sample name to uniquely identify which samples should be grouped. Defaults to ["LHCX1g1", "LHCX1g2"]
+        alignOn (string, optional): The column the runs are lined up on: "No." (the step), "PAR", or "t" (the time since the start of each run). Defaults to "No.".
+        valueColumns (list of strings, optional): The columns to calculate statistics for. Defaults to ["NPQown", "rETR", "qP", "PSII'"].
+        timeResolution (float, optional): When aligning on "t", the times since the start of the runs are rounded to this many seconds. Defaults to 1.0.
+        runOffsets (numpy array of ints, optional): The row number of the first row of each run, needed when aligning on "t". Defaults to None.
+
+    Returns:
+        pandas DataFrame: One row per group and step with the columns group, the alignOn column, and <value>_mean, <value>_SD, <value>_SE and <value>_n for each value column.
+
+    Raises:
+        ValueError: If alignOn is "t" and no runOffsets are given.
+    """
+    if alignOn == "t" and runOffsets is None:
+        raise ValueError("Aligning the group statistics on t needs the runOffsets of the runs")
+    groupNames = [wildtypeTag] + list(sampleTags)
+    statisticsColumns = ["group", alignOn] + [f"{value}_{statistic}" for value in valueColumns for statistic in ["mean", "SD", "SE", "n"]]
+    if len(mainOut_df) == 0:
+        return pd.DataFrame(columns=statisticsColumns)
+    if alignOn == "t":
+        # The time since the start of the run each row belongs to
+        runOffsets = np.asarray(runOffsets, dtype=np.int64)
+        runLengths = np.diff(np.append(runOffsets, len(mainOut_df)))
+        t = mainOut_df["t"].to_numpy(dtype=np.float64)
+        alignValues = np.round((t - np.repeat(t[np.minimum(runOffsets, len(t) - 1)], runLengths)) / timeResolution) * timeResolution
+    else:
+        alignValues = mainOut_df[alignOn].to_numpy()
+    sampleNames = mainOut_df["sampleName"].astype(str)
+
+    # Put the rows of every group after each other. A run in more than one group is repeated once per group
+    groupBlocks = []
+    for groupName in groupNames:
+        inGroup = sampleNames.str.contains(groupName, regex=False).to_numpy()
+        if inGroup.any():
+            groupBlock = mainOut_df.loc[inGroup, valueColumns].reset_index(drop=True)
+            groupBlock.insert(0, alignOn, alignValues[inGroup])
+            groupBlock.insert(0, "group", groupName)
+            groupBlocks.append(groupBlock)
+    if not groupBlocks:
+        return pd.DataFrame(columns=statisticsColumns)
+    groupedRows_df = pd.concat(groupBlocks, ignore_index=True)
+    # Keep the groups in the order they were given in
+    groupedRows_df["group"] = pd.Categorical(groupedRows_df["group"], categories=groupNames, ordered=True)
+
+    aggregated_df = groupedRows_df.groupby(["group", alignOn], observed=True, sort=True)[valueColumns].agg(["mean", "std", "count"])
+    statistics_df = pd.DataFrame(index=aggregated_df.index)
+    for value in valueColumns:
+        statistics_df[f"{value}_mean"] = aggregated_df[(value, "mean")]
+        statistics_df[f"{value}_SD"] = aggregated_df[(value, "std")]
+        statistics_df[f"{value}_SE"] = aggregated_df[(value, "std")] / np.sqrt(aggregated_df[(value, "count")])
+        statistics_df[f"{value}_n"] = aggregated_df[(value, "count")]
+    statistics_df = statistics_df.reset_index()
+    statistics_df["group"] = statistics_df["group"].astype(str)
+    return statistics_df
+
+def renderExperimentFigure(experimentID, outputPath, x_axis = ["t"], y_axis = ["NPQown", "rETR"], plotDimensions = (7, 2), wildtypeTag = "WT", sampleTags = ["LHCX1g1", "LHCX1g2"], workers=1, dpi=150, showGroupStatistics=False, report=None, skipBadFiles=False, executor=None):
+    """Draws the same figure as graphData without a display and saves it to a file. The figure is drawn on the Agg canvas
+    directly instead of through pyplot, and all runs of a group in a subplot are drawn as one LineCollection, so hundreds of runs
+    take about as long to draw as a few. With showGroupStatistics each group is instead drawn as its mean with a shaded band of
+    ± one standard deviation (see aggregateGroupStatistics), for the subplots with "t", "PAR" or "No." on the x-axis.
+
+    Args:
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+        outputPath (string): The file to save the figure to. The format follows the file ending (f.ex. .png, .svg or .pdf).
+        x_axis (list of strings, optional): The column headers which should be plotted along the x-axes. Defaults to ["t"].
+        y_axis (list of strings, optional): The column headers which should be plotted along the y-axes. Defaults to ["NPQown", "rETR"].
+        plotDimensions (tuple, optional): The size of each subplot in inches. Defaults to (7, 2).
+        wildtypeTag (string, optional): A string describing which samples based on local ID should be classified as wildtype when plotted. Defaults to "WT".
+        sampleTags (list of strings, optional): A list describing which samples based on local ID should be classified as diffrent samples when plotted. Defaults to ["LHCX1g1", "LHCX1g2"].
+        workers (int, optional): The number of worker processes used to read the files. Defaults to 1.
+        dpi (int, optional): The resolution of raster formats such as .png. Defaults to 150.
+        showGroupStatistics (bool, optional): Draw the mean ± SD of each group instead of the separate runs. Defaults to False.
+        report (dict, optional): A report from pipelineReport.newPipelineReport which gets the measurements of the reading, calculating and drawing. Defaults to None.
+        skipBadFiles (bool, optional): Leave out the run files which fail their checks (see mapFiles) instead of stopping. Defaults to False.
+        executor (concurrent.futures.Executor, optional): A process pool shared by several calls, used instead of starting a pool of workers for these files. Defaults to None.
+
+    Returns:
+        string: The path the figure was saved to.
+    """
+    quarantine = {} if skipBadFiles else None
+    sampleNamesPerRun, runOffsets, calculatedPAMdata_df, calcValuesOut = calculateExperimentBatch(experimentID, workers=workers, report=report, quarantine=quarantine, executor=executor)
+    saveQuarantineList(experimentID, quarantine)
+    checkRunsLeft(experimentID, len(sampleNamesPerRun), quarantine)
+    return saveExperimentFigure(experimentID, sampleNamesPerRun, runOffsets, calculatedPAMdata_df, outputPath, x_axis=x_axis, y_axis=y_axis, plotDimensions=plotDimensions, wildtypeTag=wildtypeTag, sampleTags=sampleTags, dpi=dpi, showGroupStatistics=showGroupStatistics, report=report)
+
+def saveExperimentFigure(experimentID, sampleNamesPerRun, runOffsets, calculatedPAMdata_df, outputPath, x_axis = ["t"], y_axis = ["NPQown", "rETR"], plotDimensions = (7, 2), wildtypeTag = "WT", sampleTags = ["LHCX1g1", "LHCX1g2"], dpi=150, showGroupStatistics=False, report=None):
+    """Draws and saves the figure of renderExperimentFigure from runs which are already calculated (see calculateExperiment).
+
+    Args:
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+        sampleNamesPerRun (list of lists of strings): The sample names of each run.
+        runOffsets (numpy array of ints): The row number of the first row of each run.
+        calculatedPAMdata_df (pandas DataFrame): The data of all runs after each other.
+        The other arguments are the same as for renderExperimentFigure.
+
+    Returns:
+        string: The path the figure was saved to.
+    """
+    with pipelineReport.measureStage(report, "render", os.path.basename(os.path.normpath(experimentID))) as stage:
+        drawExperimentFigure(sampleNamesPerRun, runOffsets, calculatedPAMdata_df, outputPath, x_axis, y_axis, plotDimensions, wildtypeTag, sampleTags, dpi, showGroupStatistics)
+        stage["rows"] = len(calculatedPAMdata_df)
+        stage["bytes"] = pipelineReport.getFileSizes([outputPath])
+    return outputPath
+
+def drawExperimentFigure(sampleNamesPerRun, runOffsets, calculatedPAMdata_df, outputPath, x_axis, y_axis, plotDimensions, wildtypeTag, sampleTags, dpi, showGroupStatistics):
+    """Draws and saves the figure of renderExperimentFigure from the output of calculateExperimentBatch."""
+    runEnds = np.append(runOffsets[1:], len(calculatedPAMdata_df)).astype(np.int64)
+    # Decide which runs belong to which group once, instead of for every subplot
+    groups = [group for group in groupRunsByTag(sampleNamesPerRun, wildtypeTag, sampleTags) if group[2]]
+    if showGroupStatistics:
+        # The statistics need the sample name of every row
+        runLengths = runEnds - runOffsets
+        statisticsInput_df = calculatedPAMdata_df.assign(sampleName=runSampleNameColumn(sampleNamesPerRun, runLengths))
+
+    fig = Figure(figsize=(len(y_axis)*plotDimensions[0], len(x_axis)*plotDimensions[1]))
+    FigureCanvasAgg(fig)
+    # squeeze=False always gives a 2D array of subplots, so no accessAxes is needed
+    ax = fig.subplots(len(x_axis), len(y_axis), squeeze=False)
+    for i in range(len(x_axis)):
+        x = calculatedPAMdata_df[x_axis[i]].to_numpy(dtype=np.float64)
+        if showGroupStatistics and x_axis[i] in ["t", "PAR", "No."]:
+            statistics_df = aggregateGroupStatistics(statisticsInput_df, wildtypeTag, sampleTags, alignOn=x_axis[i], valueColumns=list(y_axis), runOffsets=runOffsets)
+            for j in range(len(y_axis)):
+                subplot = ax[i][j]
+                subplot.set_xlabel(x_axis[i] if x_axis[i] != "t" else "t (since start of run)")
+                subplot.set_ylabel(y_axis[j])
+                for sampleTag, color, runNumbers in groups:
+                    groupStatistics_df = statistics_df[statistics_df["group"] == sampleTag]
+                    mean = groupStatistics_df[f"{y_axis[j]}_mean"].to_numpy(dtype=np.float64)
+                    SD = groupStatistics_df[f"{y_axis[j]}_SD"].fillna(0).to_numpy(dtype=np.float64)
+                    subplot.plot(groupStatistics_df[x_axis[i]], mean, color=color, label=sampleTag)
+                    subplot.fill_between(groupStatistics_df[x_axis[i]], mean - SD, mean + SD, color=color, alpha=0.25, linewidth=0)
+            continue
+        for j in range(len(y_axis)):
+            y = calculatedPAMdata_df[y_axis[j]].to_numpy(dtype=np.float64)
+            points = np.column_stack((x, y))
+            subplot = ax[i][j]
+            subplot.set_xlabel(x_axis[i])
+            subplot.set_ylabel(y_axis[j])
+            for sampleTag, color, runNumbers in groups:
+                # One line segment list for all runs in the group
+                segments = [points[runOffsets[runNumber]:runEnds[runNumber]] for runNumber in runNumbers]
+                subplot.add_collection(LineCollection(segments, colors=color, label=sampleTag))
+            subplot.autoscale_view()
+    # One legend entry per group, placed to the right of the last subplot
+    legendHandles = [Line2D([], [], color=color, label=sampleTag) for sampleTag, color, runNumbers in groups]
+    if legendHandles:
+        ax[0][-1].legend(handles=legendHandles, bbox_to_anchor=(1.05, 1), loc='upper left', borderaxespad=0.)
+    createDirectoryIfNotPresent(os.path.dirname(os.path.abspath(outputPath)))
+    fig.savefig(outputPath, dpi=dpi, bbox_inches="tight")
+
 def writeXLSXfile(filepath, list_of_frames, sheet_names_list):
     """This function takes in a filepath and based on a list of pandas dataframes and a list of sheet names
     for which worksheet the dataframes should be saved creates a .xlsx from the pandaframes.
@@ -200,13 +1017,82 @@ def writeXLSXfile(filepath, list_of_frames, sheet_names_list):
         filepath (string): a filepath describing where the .xslx file should be created.
         list_of_frames (list of pandas dataFrames): The list of dataframes which should be saved to a .xlsx file.
         sheet_names_list (list of strings): The list of names for the sheets where the respective dataframes should be saved. 
+
+    Raises:
+        ValueError: If the list of sheet names is not as long as the list of dataframes.
     """
     if (len(list_of_frames) != len(sheet_names_list)):
-        print("Error: the list of sheet names must be as long as the list of pandas dataframes")
-        return 0
+        raise ValueError(f"The list of sheet names must be as long as the list of pandas dataframes, got {len(sheet_names_list)} names for {len(list_of_frames)} dataframes")
     with pd.ExcelWriter(filepath, mode="w") as writer:
         for i, dataFrame in enumerate(list_of_frames):
-            dataFrame.to_excel(writer, sheet_name=sheet_names_list[i])
+            decimalFloatColumns(dataFrame).to_excel(writer, sheet_name=sheet_names_list[i])
+
+def decimalFloatColumns(dataFrame):
+    """Returns the frame with its float32 columns as float64 holding the shortest decimal of each float32 value, for writers
+    which store doubles (Excel, SQLite). Widening the float32 directly would write 0.464 as 0.4639999866485596.
+
+    Args:
+        dataFrame (pandas DataFrame): The frame to write.
+
+    Returns:
+        pandas DataFrame: The frame with float64 instead of float32 columns. The frame itself if it has no float32 columns.
+    """
+    float32Columns = [column for column in dataFrame.columns if dataFrame[column].dtype == np.float32]
+    if not float32Columns:
+        return dataFrame
+    return dataFrame.astype({column: str for column in float32Columns}).astype({column: np.float64 for column in float32Columns})
+
+def writeParquetDataset(datasetPath, experimentID, mainOut_df, calcValuesOut, groupStatistics_df=None):
+    """Saves the merged data of one experiment into two Parquet datasets (mainData and maxValues) partitioned by experiment,
+    so that datasetPath/mainData/experimentID=<experimentID>/ holds the data of one experiment. Rerunning an experiment replaces its partition.
+    sampleName is stored as a category, which Parquet keeps dictionary-encoded. Requires pyarrow.
+
+    Args:
+        datasetPath (string): The directory holding the mainData and maxValues datasets.
+        experimentID (string): The name of the experiment, used as the partition.
+        mainOut_df (pandas DataFrame): The main data as returned by assembleMergedFrames.
+        calcValuesOut (pandas DataFrame): The max values as returned by assembleMergedFrames.
+        groupStatistics_df (pandas DataFrame, optional): The group statistics from aggregateGroupStatistics, saved as a third dataset (groupStatistics) if given. Defaults to None.
+    """
+    # Store the sample names once per file instead of once per row
+    mainData_df = mainOut_df.astype({"sampleName": "category"})
+    # Move the sample names of the max values from the row names into a column
+    maxValues_df = calcValuesOut.rename_axis("sampleName").reset_index().astype({"sampleName": "category"})
+    datasets = [("mainData", mainData_df), ("maxValues", maxValues_df)]
+    if groupStatistics_df is not None:
+        datasets.append(("groupStatistics", groupStatistics_df.astype({"group": "category"})))
+    for datasetName, dataFrame in datasets:
+        partitionPath = f"{datasetPath}/{datasetName}/experimentID={experimentID}"
+        createDirectoryIfNotPresent(partitionPath)
+        dataFrame.to_parquet(f"{partitionPath}/part-0.parquet", index=False)
+
+def readParquetDataset(datasetPath, datasetName="mainData", experimentIDs=None):
+    """Loads the merged data of one or more experiments from the Parquet datasets written by writeParquetDataset. Requires pyarrow.
+
+    Args:
+        datasetPath (string): The directory holding the mainData and maxValues datasets.
+        datasetName (string, optional): Which dataset to load, "mainData" or "maxValues". Defaults to "mainData".
+        experimentIDs (list of strings, optional): The experiments to load. Loads all experiments if None. Defaults to None.
+
+    Returns:
+        pandas DataFrame: The data of the selected experiments with an experimentID column. Columns which only some experiments have
+            (f.ex. the light curve parameters, or instrument columns of another setup) are NaN for the others.
+    """
+    # pyarrow is only needed for the Parquet datasets
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    # The experiment names are kept as strings, f.ex. 20230314 is not read as a number
+    partitioning = ds.HivePartitioning.discover(schema=pa.schema([("experimentID", pa.string())]))
+    dataset = ds.dataset(f"{datasetPath}/{datasetName}", format="parquet", partitioning=partitioning)
+    # A dataset takes its schema from the first file, so the columns of all files are combined to keep the columns of every experiment
+    fileSchemas = [fragment.physical_schema for fragment in dataset.get_fragments()]
+    if fileSchemas:
+        schema = pa.unify_schemas(fileSchemas + [pa.schema([dataset.schema.field("experimentID")])], promote_options="permissive")
+        dataset = ds.dataset(f"{datasetPath}/{datasetName}", format="parquet", partitioning=partitioning, schema=schema)
+    # Only the partitions of the selected experiments are read
+    experimentFilter = None if experimentIDs is None else ds.field("experimentID").isin([str(experimentID) for experimentID in experimentIDs])
+    dataFrame = dataset.to_table(filter=experimentFilter).to_pandas()
+    return dataFrame.astype({"experimentID": "category"})
 
 def createDirectoryIfNotPresent(directoryPath):
     """This function takes in a filepath, and if that filepath doesn't lead to a directory creates a directory there.
@@ -217,7 +1103,7 @@ def createDirectoryIfNotPresent(directoryPath):
     if not os.path.exists(directoryPath):
         os.makedirs(directoryPath)
 
-def graphData(experimentID, mpl_ax=None, x_axis = ["t"], y_axis = ["NPQown", "rETR"], plotDimensions = (7, 2), wildtypeTag = "WT", sampleTags = ["LHCX1g1", "LHCX1g2"]):
+def graphData(experimentID, mpl_ax=None, x_axis = ["t"], y_axis = ["NPQown", "rETR"], plotDimensions = (7, 2), wildtypeTag = "WT", sampleTags = ["LHCX1g1", "LHCX1g2"], workers=1, outputPath=None, showGroupStatistics=False, report=None, skipBadFiles=False, executor=None):
     """This function assembles the plot from all the files in the experiment directory.
 
     Args:
@@ -228,126 +1114,371 @@ def graphData(experimentID, mpl_ax=None, x_axis = ["t"], y_axis = ["NPQown", "rE
         plotDimensions (tuple, optional): a size for the subplots (does not work!!!). Defaults to (7, 2).
         wildtypeTag (string, optional): A string describing which samples based on local ID should be classified as wildtype when plotted. Defaults to "WT".
         sampleTags (list of strings, optional): A list describing which samples based on local ID should be classified as diffrent samples when plotted. Defaults to ["LHCX1g1", "LHCX1g2"].
+        workers (int, optional): The number of worker processes used to read and calculate the files. Defaults to 1.
+        outputPath (string, optional): If given, the figure is drawn without a display by renderExperimentFigure and saved to this file (.png, .svg, .pdf, ...) instead of shown. Defaults to None.
+        showGroupStatistics (bool, optional): When saving to outputPath, draw the mean ± SD band of each group instead of the separate runs. Defaults to False.
+        report (dict, optional): A report from pipelineReport.newPipelineReport, which gets the wall time, rows and bytes of every stage and file. Defaults to None.
+        skipBadFiles (bool, optional): Leave out the run files which fail their checks (see mapFiles) instead of stopping. Defaults to False.
+        executor (concurrent.futures.Executor, optional): A process pool shared by several calls, used instead of starting a pool of workers for these files. Defaults to None.
+    """
+    # Save the figure to a file without opening a window
+    if outputPath is not None:
+        return renderExperimentFigure(experimentID, outputPath, x_axis=x_axis, y_axis=y_axis, plotDimensions=plotDimensions, wildtypeTag=wildtypeTag, sampleTags=sampleTags, workers=workers, showGroupStatistics=showGroupStatistics, report=report, skipBadFiles=skipBadFiles, executor=executor)
+
+    # Read and calculate all files (in parallel if workers > 1), plotting is done in the main process
+    quarantine = {} if skipBadFiles else None
+    sampleNamesPerRun, runOffsets, calculatedPAMdata_df, calcValuesOut = calculateExperimentBatch(experimentID, workers=workers, report=report, quarantine=quarantine, executor=executor)
+    saveQuarantineList(experimentID, quarantine)
+    checkRunsLeft(experimentID, len(sampleNamesPerRun), quarantine)
+    showExperimentFigure(sampleNamesPerRun, runOffsets, calculatedPAMdata_df, mpl_ax=mpl_ax, x_axis=x_axis, y_axis=y_axis, plotDimensions=plotDimensions, wildtypeTag=wildtypeTag, sampleTags=sampleTags)
+
+def showExperimentFigure(sampleNamesPerRun, runOffsets, calculatedPAMdata_df, mpl_ax=None, x_axis = ["t"], y_axis = ["NPQown", "rETR"], plotDimensions = (7, 2), wildtypeTag = "WT", sampleTags = ["LHCX1g1", "LHCX1g2"]):
+    """Plots runs which are already calculated (see calculateExperiment) with plotPAMdata and shows the figure, as graphData does.
+
+    Args:
+        sampleNamesPerRun (list of lists of strings): The sample names of each run.
+        runOffsets (numpy array of ints): The row number of the first row of each run.
+        calculatedPAMdata_df (pandas DataFrame): The data of all runs after each other.
+        The other arguments are the same as for graphData.
     """
     if (mpl_ax == None):
         fig, ax = plt.subplots()
     else:
         ax = mpl_ax
-    fileNamesSeries, experimentPath = getCSVfilesList(experimentID)
-
     # Create an empty figure
     fig, ax = plt.subplots(len(x_axis), len(y_axis), figsize=(len(x_axis)*plotDimensions[0], len(y_axis)*plotDimensions[1]))
 
 
     legendList = []
 
-    for fileName in fileNamesSeries:
-        
-        listOfSampleNames = extractLocalExperimentID(fileName, experimentID)
-
-        strippedPAMdata_df = generateStrippedDataset(fileName, experimentID)
+    runEnds = np.append(runOffsets[1:], len(calculatedPAMdata_df)).astype(np.int64)
+    for listOfSampleNames, runStart, runEnd in zip(sampleNamesPerRun, runOffsets, runEnds):
 
-        calculatedPAMdata_df, calculatedValuesSeries = calculateValuesAndInject(strippedPAMdata_df, listOfSampleNames)
-        
-        ax, legendList = plotPAMdata(calculatedPAMdata_df, listOfSampleNames, mpl_ax=ax, x_axis=x_axis, y_axis=y_axis, plotDimensions=plotDimensions, wildtypeTag=wildtypeTag, sampleTags=sampleTags, legendList=legendList)
+        ax, legendList = plotPAMdata(calculatedPAMdata_df.iloc[runStart:runEnd], listOfSampleNames, mpl_ax=ax, x_axis=x_axis, y_axis=y_axis, plotDimensions=plotDimensions, wildtypeTag=wildtypeTag, sampleTags=sampleTags, legendList=legendList)
 
     labelSet = set()
     axisUniqueList = []
     for axis in legendList:
-        if axis._label not in labelSet:
+        if axis.get_label() not in labelSet:
             axisUniqueList.append(axis)
-            labelSet.add(axis._label)
+            labelSet.add(axis.get_label())
     
     plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left', borderaxespad=0., handles=axisUniqueList)
     plt.show()
 
 
-def mergeData(experimentID, saveXLSX, saveCSV, excelFileName=None, csvFileNames = [None, None]):
+def assembleMergedFrames(processedRuns):
+    """Consolidates the processed runs into one main data frame and one max values frame. The per-run blocks are
+    collected first and concatenated once at the end, so merging N runs costs time proportional to N.
+
+    Args:
+        processedRuns (list of tuples): One (listOfSampleNames, calculatedPAMdata_df, calculatedValuesSeries) tuple per run, as returned by processExperimentFiles.
+
+    Returns:
+        pandas DataFrame: All experimental data in compact form (see compactRunFrame) with the sample name of each run as the first (categorical) column.
+        pandas DataFrame: The max values (max_Fm, max_NPQ, max_Fo, max_PSII) of each run, with the sample names as row names.
+    """
+    sampleNamesPerRun = [listOfSampleNames for listOfSampleNames, calculatedPAMdata_df, calculatedValuesSeries in processedRuns]
+    runLengths = [len(calculatedPAMdata_df) for listOfSampleNames, calculatedPAMdata_df, calculatedValuesSeries in processedRuns]
+    # Merge the data for all samples in a single concatenation
+    mainOut_df = concatenateRunFrames([calculatedPAMdata_df for listOfSampleNames, calculatedPAMdata_df, calculatedValuesSeries in processedRuns])
+    # Add a column to the dataset which holds the sample names related to that data, as the first column
+    mainOut_df.insert(0, "sampleName", runSampleNameColumn(sampleNamesPerRun, runLengths))
+    # Build the max values frame with one row per sample, named after the sample
+    calcValuesOut = pd.DataFrame([calculatedValuesSeries for listOfSampleNames, calculatedPAMdata_df, calculatedValuesSeries in processedRuns], columns=["max_Fm", "max_NPQ", "max_Fo", "max_PSII"]).astype(np.float32)
+
+    return mainOut_df, calcValuesOut
+
+def calculateExperimentBatch(experimentID, workers=1, report=None, quarantine=None, executor=None, runInfo=None):
+    """Reads all run files in the experiment directory and calculates them together with calculateValuesBatch.
+
+    Args:
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+        workers (int, optional): The number of worker processes used to read the files. Defaults to 1.
+        report (dict, optional): A report from pipelineReport.newPipelineReport which gets the measurements of each file, and of the read and calculate stages. Defaults to None.
+        quarantine (dict, optional): If given, files which fail are added to it and left out instead of raising (see mapFiles). Defaults to None.
+        executor (concurrent.futures.Executor, optional): A process pool shared by several calls, used instead of starting a pool of workers for these files. Defaults to None.
+        runInfo (list, optional): If given, a (fileName, runMetadata) tuple is appended to it for every run which was not quarantined. Defaults to None.
+
+    Returns:
+        list of lists of strings: The sample names of each run which was not quarantined, in the same order as getCSVfilesList.
+        numpy array of ints: The row number of the first row of each run in the calculated data.
+        pandas DataFrame: The data of all runs after each other along with: NPQown, PSII\', qP, and rETR.
+        pandas DataFrame: The max values (max_Fm, max_NPQ, max_Fo, max_PSII) of each run, with the sample names as row names.
+    """
+    experimentName = os.path.basename(os.path.normpath(experimentID))
+    with pipelineReport.measureStage(report, "read", experimentName) as stage:
+        fileNamesSeries, experimentPath = getCSVfilesList(experimentID)
+        readRuns = mapFiles(readPAMfile, list(fileNamesSeries), experimentID, workers=workers, report=report, quarantine=quarantine, executor=executor)
+        stage["rows"] = sum(len(strippedPAMdata_df) for listOfSampleNames, runMetadata, strippedPAMdata_df in readRuns)
+        stage["bytes"] = pipelineReport.getFileSizes([f"{experimentPath}{fileName}" for fileName in fileNamesSeries])
+    if runInfo is not None:
+        keptFileNames = [fileName for fileName in fileNamesSeries if quarantine is None or fileName not in quarantine]
+        runInfo.extend((fileName, runMetadata) for fileName, (listOfSampleNames, runMetadata, strippedPAMdata_df) in zip(keptFileNames, readRuns))
+    with pipelineReport.measureStage(report, "calculate", experimentName) as stage:
+        calculatedRuns = calculateReadRuns(readRuns)
+        stage["rows"] = len(calculatedRuns[2])
+    return calculatedRuns
+
+def calculateExperiment(experimentID, workers=1, cacheDirectory=None, report=None, quarantine=None, executor=None, runInfo=None):
+    """Reads and calculates all run files in the experiment directory, once for all the outputs made from them (the merged files, the figure and the experiment store).
+    Without a cache the runs are calculated together by calculateExperimentBatch, with one only the new and changed files are processed (see processExperimentFilesCached).
+
+    Args:
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+        workers (int, optional): The number of worker processes used to read the files. Defaults to 1.
+        cacheDirectory (string, optional): If given, unchanged files are loaded from this run cache instead of being processed again. Defaults to None.
+        report (dict, optional): A report from pipelineReport.newPipelineReport which gets the measurements of each file and stage. Defaults to None.
+        quarantine (dict, optional): If given, files which fail are added to it and left out instead of raising (see mapFiles). Defaults to None.
+        executor (concurrent.futures.Executor, optional): A process pool shared by several calls, used instead of starting a pool of workers for these files. Defaults to None.
+        runInfo (list, optional): If given, a (fileName, runMetadata) tuple is appended to it for every run which was not quarantined. Defaults to None.
+
+    Returns:
+        The same as calculateExperimentBatch.
+    """
+    if cacheDirectory is None:
+        return calculateExperimentBatch(experimentID, workers=workers, report=report, quarantine=quarantine, executor=executor, runInfo=runInfo)
+    experimentName = os.path.basename(os.path.normpath(experimentID))
+    with pipelineReport.measureStage(report, "readAndCalculate", experimentName) as stage:
+        processedRuns = processExperimentFilesCached(experimentID, cacheDirectory, workers=workers, report=report, quarantine=quarantine, executor=executor, runInfo=runInfo)
+        sampleNamesPerRun = [listOfSampleNames for listOfSampleNames, calculatedPAMdata_df, calculatedValuesSeries in processedRuns]
+        runOffsets = np.cumsum([0] + [len(calculatedPAMdata_df) for listOfSampleNames, calculatedPAMdata_df, calculatedValuesSeries in processedRuns])[:-1]
+        # The runs were calculated on their own, so they only need to be put after each other
+        calculatedPAMdata_df = concatenateRunFrames([calculatedPAMdata_df for listOfSampleNames, calculatedPAMdata_df, calculatedValuesSeries in processedRuns])
+        calcValuesOut = pd.DataFrame([calculatedValuesSeries for listOfSampleNames, calculatedPAMdata_df, calculatedValuesSeries in processedRuns], columns=["max_Fm", "max_NPQ", "max_Fo", "max_PSII"]).astype(np.float32)
+        stage["rows"] = len(calculatedPAMdata_df)
+    return sampleNamesPerRun, runOffsets, calculatedPAMdata_df, calcValuesOut
+
+def addLightCurveFits(experimentID, runOffsets, calculatedPAMdata_df, calcValuesOut, lightCurveModel, report=None):
+    """Fits the rETR vs PAR light curves of all runs together and adds alpha, ETRmax, Ek, beta and the fit RMSE to the max values (see lightCurveFitting.fitLightCurves).
+
+    Args:
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+        runOffsets (numpy array of ints): The row number of the first row of each run.
+        calculatedPAMdata_df (pandas DataFrame): The data of all runs after each other, as returned by calculateExperiment.
+        calcValuesOut (pandas DataFrame): The max values of each run.
+        lightCurveModel (string): "platt" or "eilers-peeters".
+        report (dict, optional): A report from pipelineReport.newPipelineReport which gets the measurements of the fit. Defaults to None.
+
+    Returns:
+        pandas DataFrame: The max values with the light curve parameters of each run.
+    """
+    if len(calcValuesOut) == 0:
+        return calcValuesOut
+    with pipelineReport.measureStage(report, "lightCurveFit", os.path.basename(os.path.normpath(experimentID))) as stage:
+        lightCurveFits_df = lightCurveFitting.fitLightCurves(calculatedPAMdata_df["PAR"].to_numpy(), calculatedPAMdata_df["rETR"].to_numpy(), runOffsets, model=lightCurveModel)
+        lightCurveFits_df.index = calcValuesOut.index
+        stage["rows"] = len(lightCurveFits_df)
+    return pd.concat([calcValuesOut, lightCurveFits_df], axis=1)
+
+def stackRunFrames(runFrames):
+    """Puts the data of several runs after each other as they were read, without compacting them.
+
+    Args:
+        runFrames (list of pandas DataFrames): The data of each run.
+
+    Returns:
+        pandas DataFrame: The data of all runs after each other, with a new RangeIndex.
+    """
+    # Runs without rows (f.ex. Type: ICM) only have untyped columns, which would turn the other runs' columns into objects
+    runFrames = [runFrame for runFrame in runFrames if len(runFrame) > 0] or runFrames[:1]
+    if not runFrames:
+        return pd.DataFrame()
+    return pd.concat(runFrames, ignore_index=True)
+
+def concatenateRunFrames(runFrames):
+    """Puts the data of several runs after each other and converts them to the compact form (see compactRunFrame).
+
+    Args:
+        runFrames (list of pandas DataFrames): The data of each run.
+
+    Returns:
+        pandas DataFrame: The data of all runs after each other, with a new RangeIndex.
+    """
+    # All runs are compacted in one go, which also gives a single Date category for the experiment
+    return compactRunFrame(stackRunFrames(runFrames))
+
+def runSampleNameColumn(sampleNamesPerRun, runLengths):
+    """Builds the sampleName column of the merged data: the joined sample names of each run repeated over its rows,
+    stored as a category so each name is kept once instead of once per row.
+
+    Args:
+        sampleNamesPerRun (list of lists of strings): The sample names of each run.
+        runLengths (list of ints): The number of rows of each run.
+
+    Returns:
+        pandas Categorical: The sample name of every row.
+    """
+    runNames = pd.Index([", ".join(listOfSampleNames) for listOfSampleNames in sampleNamesPerRun])
+    categories = runNames.unique()
+    return pd.Categorical.from_codes(np.repeat(categories.get_indexer(runNames), runLengths), categories=categories)
+
+def calculateReadRuns(readRuns):
+    """Calculates runs read with readPAMfile together with calculateValuesBatch.
+
+    Args:
+        readRuns (list of tuples): One (listOfSampleNames, runMetadata, strippedPAMdata_df) tuple per run, as returned by readPAMfile.
+
+    Returns:
+        The same as calculateExperimentBatch.
+    """
+    if not readRuns:
+        return [], np.zeros(0, dtype=np.int64), pd.DataFrame(), pd.DataFrame(columns=["max_Fm", "max_NPQ", "max_Fo", "max_PSII"])
+    sampleNamesPerRun = [listOfSampleNames for listOfSampleNames, runMetadata, strippedPAMdata_df in readRuns]
+    runLengths = [len(strippedPAMdata_df) for listOfSampleNames, runMetadata, strippedPAMdata_df in readRuns]
+    # Stack all runs into one frame and remember where each run starts
+    runOffsets = np.cumsum([0] + runLengths[:-1])
+    stackedPAMdata_df = stackRunFrames([strippedPAMdata_df for listOfSampleNames, runMetadata, strippedPAMdata_df in readRuns])
+    # Calculate from the values as they were read, like calculateValuesAndInject does for a single run, and compact afterwards
+    calculatedPAMdata_df, calcValuesOut = calculateValuesBatch(stackedPAMdata_df, runOffsets, [", ".join(listOfSampleNames) for listOfSampleNames in sampleNamesPerRun])
+    return sampleNamesPerRun, runOffsets, compactRunFrame(calculatedPAMdata_df), calcValuesOut
+
+def addSampleNameColumn(calculatedPAMdata_df, sampleNamesPerRun, runOffsets):
+    """Adds the sample names of each run as the first (categorical) column of the output of calculateExperimentBatch and resets the row indexes.
+
+    Args:
+        calculatedPAMdata_df (pandas DataFrame): The data of all runs after each other.
+        sampleNamesPerRun (list of lists of strings): The sample names of each run.
+        runOffsets (numpy array of ints): The row number of the first row of each run.
+
+    Returns:
+        pandas DataFrame: All experimental data with the sample name of each run as the first column.
+    """
+    if not sampleNamesPerRun:
+        return assembleMergedFrames([])[0]
+    runLengths = np.diff(np.append(runOffsets, len(calculatedPAMdata_df)))
+    # The calculated data is also used for the figure and the store, so the column goes on a new frame
+    mainOut_df = calculatedPAMdata_df.reset_index(drop=True)
+    mainOut_df.insert(0, "sampleName", runSampleNameColumn(sampleNamesPerRun, runLengths))
+    return mainOut_df
+
+def mergeData(experimentID, saveXLSX, saveCSV, excelFileName=None, csvFileNames = None, workers=1, saveParquet=False, useCache=False, wildtypeTag=None, sampleTags=None, groupStatisticsAlignOn="No.", lightCurveModel=None, report=None, skipBadFiles=False, executor=None):
     """ This function takes in the experiment ID (i.e. the name of the folder/directory containing your data)
-    and based on the truthiness of saveXLSX and saveCSV saves the data from your PAM fluorometry experiment into 
-    a large .xlsx and two .CSV files respectively.
+    and based on the truthiness of saveXLSX, saveCSV and saveParquet saves the data from your PAM fluorometry experiment into 
+    a large .xlsx, two .CSV files and two partitioned Parquet datasets respectively.
 
     Args:
         experimentID (string): The path/folder/directory name of the directory where your PAM data is stored. (must be in the same directory as the program).
         saveXLSX (bool): If True it saves the data into an .xlsx file.
         saveCSV (bool): If True it saves the data into two .csv files.
         excelFileName (string, optional): Is the name you want to give your merged data .xlsx file. Defaults to None.
-        csvFileNames (list of strings, optional): Is a list of names for the main data .CSV followed by the name of the maximal values data .CSV file. Defaults to [None, None].
+        csvFileNames (list of strings, optional): Is a list of names for the main data .CSV followed by the name of the maximal values data .CSV file. Defaults to None (i.e. [None, None]).
+        workers (int, optional): The number of worker processes used to read and calculate the files. Defaults to 1.
+        saveParquet (bool, optional): If True it saves the data into the Parquet datasets in myPAMresults/parquet (requires pyarrow). Defaults to False.
+        useCache (bool, optional): If True the processed runs are cached in myPAMresults/<experiment name>_cache, so that later merges only process new or changed files. Defaults to False.
+        wildtypeTag (string, optional): If this or sampleTags is given, the mean, SD, SE and n of each group are saved along with the data (see aggregateGroupStatistics). Defaults to None.
+        sampleTags (list of strings, optional): The sample tags of the groups for the statistics. Defaults to None.
+        groupStatisticsAlignOn (string, optional): The column the runs are lined up on for the statistics: "No.", "PAR" or "t". Defaults to "No.".
+        lightCurveModel (string, optional): If "platt" or "eilers-peeters", the rETR vs PAR light curve of every run is fitted with this model and
+            alpha, ETRmax, Ek, beta and the fit RMSE are added to the max values (see lightCurveFitting.fitLightCurves). Defaults to None.
+        report (dict, optional): A report from pipelineReport.newPipelineReport, which gets the wall time, rows and bytes of every stage and file. Defaults to None.
+        skipBadFiles (bool, optional): Leave out the run files which fail their checks (see mapFiles) instead of stopping the merge, and list them with
+            the reasons in myPAMresults/<experiment name>_quarantine.json. Defaults to False.
+        executor (concurrent.futures.Executor, optional): A process pool shared by several calls, used instead of starting a pool of workers for these files. Defaults to None.
 
     Returns:
         This function returns nothing.
     """
-    # If the pandas dataframes should be saved run the following 
-    if saveXLSX or saveCSV:
-        # Create the dataframes where data will be consolidated
-        mainOut_df = pd.DataFrame()
-        calcValuesOut = pd.DataFrame(columns=["max_Fm", "max_NPQ", "max_Fo", "max_PSII"])
-    else:
-        #if the function has been called while no data should be saved retrun -1 and exit
+    #if the function has been called while no data should be saved retrun -1 and exit
+    if not (saveXLSX or saveCSV or saveParquet):
         return -1
-    
-    # Get a list of all files within the experiments directory. defaults to .csv files with the ";" delimiter and ending with ").csv"
-    filesNameSeries, experimentPath = getCSVfilesList(experimentID)
-
-    for fileName in filesNameSeries:
-        # Get all sample names associated with each run, delimited by ",". load the data into a pandas Dataframe.
-        listOfSampleNames = extractLocalExperimentID(fileName, experimentID)
-
-        # Remove the upper 3 and lower 1 row of the .csv file as they do not contain experiment data
-        strippedPAMdata_df = generateStrippedDataset(fileName, experimentID)
-        # Calculate the NPQown, PSII', qP, and rETR values, and insert them into the dataframe. Also get max values for Fm, NPQ, Fo, and PSII which is then placed into a pandas Series.
-        calculatedPAMdata_df, calculatedValuesSeries = calculateValuesAndInject(strippedPAMdata_df, listOfSampleNames)
-        
-        # Main Data
-        # Add a column to the dataset which holds the sample names related to that data 
-        calculatedPAMdata_df["sampleName"] = ", ".join(listOfSampleNames)
-        # Merge the data for the current sample with the dataframe which holds all experimental data.
-        mainOut_df = pd.concat([mainOut_df, calculatedPAMdata_df])
-
-        # Max values
-        # make the Series into a DataFrame with max values along the columns, and row name equal to the sample 
-        calculatedValuesFrame = calculatedValuesSeries.to_frame().swapaxes(0,1)
-        # Merge the max values for the current sample with the dataframe which holds all max values for all samples. 
-        calcValuesOut = pd.concat([calcValuesOut, calculatedValuesFrame])
-        
-        
-    # Rearrange the columns so the sample name column is the first column
-    # Get the columns of the dataframe as a list
-    df_cols = list(mainOut_df)
-    # Delete the "sampleName" entry in the list and add it to the front
-    df_cols.insert(0, df_cols.pop(df_cols.index("sampleName")))
-    # Rearrange the columns of the dataframe according to the list
-    mainOut_df = mainOut_df.loc[:, df_cols]
-    # Reset the row indexes
-    mainOut_df = mainOut_df.reset_index()
 
-    # Create results directory
+    # Name the output files after the last part of the experiment path, so f.ex. "archive/20230314" gives "20230314.xlsx"
+    experimentName = os.path.basename(os.path.normpath(experimentID))
+
+    # Read every file within the experiments directory once and calculate the NPQown, PSII', qP, and rETR values along with the max values for Fm, NPQ, Fo, and PSII.
+    # The files are read in a pool of worker processes if workers > 1, the results are kept in file order.
+    # With useCache only the files which are new or changed since the last merge are processed.
     results_directory = "myPAMresults"
+    # Files which fail their checks are collected here instead of stopping the merge
+    quarantine = {} if skipBadFiles else None
+    cacheDirectory = f"./{results_directory}/{experimentName}_cache" if useCache else None
+    sampleNamesPerRun, runOffsets, calculatedPAMdata_df, calcValuesOut = calculateExperiment(experimentID, workers=workers, cacheDirectory=cacheDirectory, report=report, quarantine=quarantine, executor=executor)
+
+    # List the quarantined files next to the merged data, so they can be looked at and fixed
+    saveQuarantineList(experimentID, quarantine)
+    checkRunsLeft(experimentID, len(calcValuesOut), quarantine)
+
+    # Fit the light curves of all runs together and add the parameters to the max values
+    if lightCurveModel is not None:
+        calcValuesOut = addLightCurveFits(experimentID, runOffsets, calculatedPAMdata_df, calcValuesOut, lightCurveModel, report=report)
+
+    writeMergedData(experimentID, sampleNamesPerRun, runOffsets, calculatedPAMdata_df, calcValuesOut, saveXLSX, saveCSV, excelFileName=excelFileName, csvFileNames=csvFileNames, saveParquet=saveParquet,
+                    wildtypeTag=wildtypeTag, sampleTags=sampleTags, groupStatisticsAlignOn=groupStatisticsAlignOn, report=report)
+
+def writeMergedData(experimentID, sampleNamesPerRun, runOffsets, calculatedPAMdata_df, calcValuesOut, saveXLSX, saveCSV, excelFileName=None, csvFileNames=None, saveParquet=False, wildtypeTag=None, sampleTags=None, groupStatisticsAlignOn="No.", report=None):
+    """Saves the calculated runs of an experiment as mergeData does, for callers which already calculated them (see calculateExperiment).
+
+    Args:
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+        sampleNamesPerRun (list of lists of strings): The sample names of each run.
+        runOffsets (numpy array of ints): The row number of the first row of each run.
+        calculatedPAMdata_df (pandas DataFrame): The data of all runs after each other. It is not changed.
+        calcValuesOut (pandas DataFrame): The max values (and light curve parameters) of each run.
+        The other arguments are the same as for mergeData.
+    """
+    experimentName = os.path.basename(os.path.normpath(experimentID))
+    results_directory = "myPAMresults"
+    with pipelineReport.measureStage(report, "merge", experimentName) as stage:
+        mainOut_df = addSampleNameColumn(calculatedPAMdata_df, sampleNamesPerRun, runOffsets)
+        stage["rows"] = len(mainOut_df)
+
+    # Calculate the statistics of each group if any groups are given
+    groupStatistics_df = None
+    if wildtypeTag is not None or sampleTags is not None:
+        with pipelineReport.measureStage(report, "groupStatistics", experimentName) as stage:
+            groupStatistics_df = aggregateGroupStatistics(mainOut_df, wildtypeTag if wildtypeTag is not None else "WT", sampleTags if sampleTags is not None else [], alignOn=groupStatisticsAlignOn, runOffsets=runOffsets)
+            stage["rows"] = len(groupStatistics_df)
+
+    # Create results directory
     createDirectoryIfNotPresent(f"./{results_directory}")
     # Set the name of the excel file if none are given
     if excelFileName == None:
-        excelFileName = f"{experimentID}.xlsx"
+        excelFileName = f"{experimentName}.xlsx"
 
     # Save as excel file if saveXLSX is true
     if saveXLSX:
-        writeXLSXfile(f"./{results_directory}/{excelFileName}", [mainOut_df, calcValuesOut], ["mainData", "maxValues"])
+        with pipelineReport.measureStage(report, "writeXLSX", experimentName) as stage:
+            if groupStatistics_df is None:
+                writeXLSXfile(f"./{results_directory}/{excelFileName}", [mainOut_df, calcValuesOut], ["mainData", "maxValues"])
+            else:
+                writeXLSXfile(f"./{results_directory}/{excelFileName}", [mainOut_df, calcValuesOut, groupStatistics_df], ["mainData", "maxValues", "groupStatistics"])
+            stage["rows"] = len(mainOut_df)
+            stage["bytes"] = pipelineReport.getFileSizes([f"./{results_directory}/{excelFileName}"])
     
-    # Set names for .csv files if none are given
+    # Set names for .csv files if none are given. The list is copied so the names given by the caller are not changed
+    csvFileNames = [None, None] if csvFileNames is None else list(csvFileNames)
     if (csvFileNames[0] == None):
-        csvFileNames[0] = f"{experimentID}_mainData.CSV"
+        csvFileNames[0] = f"{experimentName}_mainData.CSV"
     if (csvFileNames[1] == None):
-        csvFileNames[1] = f"{experimentID}_maxData.CSV"
+        csvFileNames[1] = f"{experimentName}_maxData.CSV"
 
     # Save as .csv files if saveCSV is true
     if saveCSV:
-        mainOut_df.to_csv(f"./{results_directory}/{csvFileNames[0]}")
-        calcValuesOut.to_csv(f"./{results_directory}/{csvFileNames[1]}")
+        with pipelineReport.measureStage(report, "writeCSV", experimentName) as stage:
+            mainOut_df.to_csv(f"./{results_directory}/{csvFileNames[0]}")
+            calcValuesOut.to_csv(f"./{results_directory}/{csvFileNames[1]}")
+            if groupStatistics_df is not None:
+                groupStatistics_df.to_csv(f"./{results_directory}/{experimentName}_groupStatistics.CSV")
+            stage["rows"] = len(mainOut_df)
+            # The group statistics file is only counted if it was written by this merge
+            csvFilePaths = [f"./{results_directory}/{csvFileNames[0]}", f"./{results_directory}/{csvFileNames[1]}"]
+            if groupStatistics_df is not None:
+                csvFilePaths.append(f"./{results_directory}/{experimentName}_groupStatistics.CSV")
+            stage["bytes"] = pipelineReport.getFileSizes(csvFilePaths)
+
+    # Save as Parquet datasets if saveParquet is true
+    if saveParquet:
+        with pipelineReport.measureStage(report, "writeParquet", experimentName) as stage:
+            writeParquetDataset(f"./{results_directory}/parquet", experimentName, mainOut_df, calcValuesOut, groupStatistics_df)
+            stage["rows"] = len(mainOut_df)
 
-exp_ID = "20230314"
+if __name__ == "__main__":
+    exp_ID = "20230314"
 
-csv_list = getCSVfilesList(exp_ID)[0]
-print(csv_list[0])
-df_strip_dataset = generateStrippedDataset(csv_list[0], exp_ID)
-print(df_strip_dataset)
-df_strip_dataset, max_values_series = calculateValuesAndInject(df_strip_dataset, csv_list)
-print(df_strip_dataset)
\ No newline at end of file
+    csv_list = getCSVfilesList(exp_ID)[0]
+    print(csv_list[0])
+    df_strip_dataset = generateStrippedDataset(csv_list[0], exp_ID)
+    print(df_strip_dataset)
+    df_strip_dataset, max_values_series = calculateValuesAndInject(df_strip_dataset, csv_list)
+    print(df_strip_dataset)
\ No newline at end of file
@@ -0,0 +1,57 @@
+"""Benchmark showing how merging scales with the number of runs.
+
+Compares the old merge loop (growing the output frames with pd.concat for every file) with
+assembleMergedFrames (collect every run, concatenate once). Each run is a copy of the
+20230314 light curve, so only the merge step is timed.
+
+Run from the repository root:
+    python benchmarks/mergeScaling.py 100 500 1000 2000
+"""
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import PAMflourometryDataTransfom as dT
+
+
+def quadraticMerge(processedRuns):
+    """The merge loop as it was before assembleMergedFrames: the accumulated frames are copied for every run."""
+    mainOut_df = pd.DataFrame()
+    calcValuesOut = pd.DataFrame(columns=["max_Fm", "max_NPQ", "max_Fo", "max_PSII"])
+    for listOfSampleNames, calculatedPAMdata_df, calculatedValuesSeries in processedRuns:
+        calculatedPAMdata_df["sampleName"] = ", ".join(listOfSampleNames)
+        mainOut_df = pd.concat([mainOut_df, calculatedPAMdata_df])
+        calcValuesOut = pd.concat([calcValuesOut, calculatedValuesSeries.to_frame().T])
+    return mainOut_df, calcValuesOut
+
+
+def makeRuns(runCount):
+    """Builds runCount processed runs from the 20230314 example file."""
+    listOfSampleNames, calculatedPAMdata_df, calculatedValuesSeries = dT.processPAMfile("20230314_1(1).CSV", "20230314")
+    processedRuns = []
+    for i in range(runCount):
+        sampleNames = [f"WT {i}"]
+        processedRuns.append((sampleNames, calculatedPAMdata_df.copy(), calculatedValuesSeries.rename(sampleNames[0])))
+    return processedRuns
+
+
+def timeMerge(mergeFunction, runCount):
+    processedRuns = makeRuns(runCount)
+    start = time.perf_counter()
+    mergeFunction(processedRuns)
+    return time.perf_counter() - start
+
+
+def main(runCounts):
+    print(f"{'runs':>8} {'concat loop (s)':>16} {'per run (ms)':>13} {'collect (s)':>12} {'per run (ms)':>13}")
+    for runCount in runCounts:
+        quadraticSeconds = timeMerge(quadraticMerge, runCount)
+        collectSeconds = timeMerge(dT.assembleMergedFrames, runCount)
+        print(f"{runCount:>8} {quadraticSeconds:>16.3f} {1000*quadraticSeconds/runCount:>13.3f} {collectSeconds:>12.3f} {1000*collectSeconds/runCount:>13.3f}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [100, 500, 1000, 2000])
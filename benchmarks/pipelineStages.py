@@ -0,0 +1,136 @@
+"""Stage by stage timings of the processing pipeline on synthetic experiments.
+
+For each run count a synthetic experiment is written with syntheticDataset.generateExperiment and
+the stages are timed separately: getCSVfilesList, generateStrippedDataset and calculateValuesAndInject
+(for every file), mergeData to CSV and to xlsx, graphData (saved to a png without a display) and,
+with --raw-traces, recalculateRunFromRawTrace. The timings are written as JSON so runs on different
+commits or machines can be compared.
+
+Run from the repository root:
+    python benchmarks/pipelineStages.py 10 100 1000 --output benchmarks/results.json
+    python benchmarks/pipelineStages.py 100 --raw-traces --repeat 3
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import matplotlib
+import numpy as np
+import pandas as pd
+
+repositoryDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, repositoryDirectory)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import PAMflourometryDataTransfom as dT
+import rawTraceData
+import syntheticDataset
+
+# Excel sheets hold at most 1048576 rows including the header
+excelRowLimit = 1048575
+
+
+def timeStage(stageFunction, repeat):
+    """Calls stageFunction repeat times and returns the fastest time in seconds and the result of the last call."""
+    fastest = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = stageFunction()
+        seconds = time.perf_counter() - start
+        fastest = seconds if fastest is None else min(fastest, seconds)
+    return fastest, result
+
+
+def benchmarkExperiment(experimentID, runCount, rawTraces, repeat, workers):
+    """Times every stage on one experiment directory (relative to the current directory).
+
+    Returns:
+        dict: The run and row counts and the seconds (and milliseconds per run) of each stage. Skipped stages give the reason instead.
+    """
+    stages = {}
+
+    def record(stageName, stageFunction):
+        seconds, result = timeStage(stageFunction, repeat)
+        stages[stageName] = {"seconds": seconds, "msPerRun": 1000 * seconds / runCount}
+        return result
+
+    fileNamesSeries, experimentPath = record("getCSVfilesList", lambda: dT.getCSVfilesList(experimentID))
+    fileNames = list(fileNamesSeries)
+    strippedRuns = record("generateStrippedDataset", lambda: [dT.generateStrippedDataset(fileName, experimentID) for fileName in fileNames])
+    rowCount = sum(len(strippedPAMdata_df) for strippedPAMdata_df in strippedRuns)
+    # calculateValuesAndInject adds columns to the frames it is given, so each repeat gets fresh copies
+    record("calculateValuesAndInject", lambda: [dT.calculateValuesAndInject(strippedPAMdata_df.copy(), [fileName]) for fileName, strippedPAMdata_df in zip(fileNames, strippedRuns)])
+    record("mergeData (CSV)", lambda: dT.mergeData(experimentID, saveXLSX=False, saveCSV=True, workers=workers))
+    if rowCount <= excelRowLimit:
+        record("mergeData (xlsx)", lambda: dT.mergeData(experimentID, saveXLSX=True, saveCSV=False, workers=workers))
+    else:
+        stages["mergeData (xlsx)"] = {"skipped": f"{rowCount} rows do not fit in an Excel sheet"}
+    record("graphData", lambda: dT.graphData(experimentID, workers=workers, outputPath=f"./myPAMresults/plots/{experimentID}.png"))
+    if rawTraces:
+        record("recalculateRunFromRawTrace", lambda: [rawTraceData.recalculateRunFromRawTrace(fileName, experimentID) for fileName in fileNames])
+    return {"experimentID": experimentID, "runs": runCount, "rows": rowCount, "rawTraces": rawTraces, "workers": workers, "stages": stages}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Time the stages of the PAM pipeline on synthetic experiments.")
+    parser.add_argument("runs", nargs="*", type=int, default=[10, 100, 1000], help="The run counts to benchmark. Defaults to 10 100 1000.")
+    parser.add_argument("--raw-traces", action="store_true", help="Also write raw traces and time recalculateRunFromRawTrace.")
+    parser.add_argument("--repeat", type=int, default=1, help="Time each stage this many times and keep the fastest. Defaults to 1.")
+    parser.add_argument("--workers", type=int, default=1, help="The workers given to mergeData and graphData. Defaults to 1.")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the synthetic data. Defaults to 0.")
+    parser.add_argument("--work-dir", default=None, help="Where the synthetic experiments and outputs are written. Kept afterwards, and reused by later runs. Defaults to a temporary directory which is removed.")
+    parser.add_argument("--output", default=None, help="The JSON file to write the timings to. Defaults to printing them.")
+    args = parser.parse_args(argv)
+
+    # Plots are only saved, never shown
+    matplotlib.use("Agg")
+    workDirectory = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix="pamBenchmark")
+    os.makedirs(workDirectory, exist_ok=True)
+    outputPath = None if args.output is None else os.path.abspath(args.output)
+    originalDirectory = os.getcwd()
+    results = []
+    try:
+        # mergeData and graphData work relative to the current directory
+        os.chdir(workDirectory)
+        for runCount in args.runs:
+            experimentID = f"synthetic_{runCount}{'_raw' if args.raw_traces else ''}_{args.seed}"
+            if not os.path.isdir(experimentID):
+                generateSeconds, fileNames = timeStage(lambda: syntheticDataset.generateExperiment(experimentID, runCount, rawTraces=args.raw_traces, seed=args.seed), 1)
+                print(f"Wrote {runCount} runs in {generateSeconds:.1f} s")
+            result = benchmarkExperiment(experimentID, runCount, args.raw_traces, args.repeat, args.workers)
+            results.append(result)
+            for stageName, stage in result["stages"].items():
+                if "seconds" in stage:
+                    print(f"{runCount:>8} runs  {stageName:<28} {stage['seconds']:>10.3f} s {stage['msPerRun']:>10.3f} ms/run")
+                else:
+                    print(f"{runCount:>8} runs  {stageName:<28} skipped: {stage['skipped']}")
+    finally:
+        os.chdir(originalDirectory)
+        if args.work_dir is None:
+            shutil.rmtree(workDirectory, ignore_errors=True)
+
+    report = {
+        "createdAt": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpuCount": os.cpu_count(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if outputPath is None:
+        print(json.dumps(report, indent=1))
+    else:
+        with open(outputPath, "w") as f:
+            json.dump(report, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
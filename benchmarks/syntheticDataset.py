@@ -0,0 +1,138 @@
+"""Generator of synthetic PAM experiments in the instrument's file format.
+
+Each run is a light curve (Type: LC) of the LightCurve_Marianne.lcp protocol written exactly like the
+fluorometer does: the sample ID line, the quoted ";" header, the Type/.par/.lcp/Fo-Fm lines, the
+data rows and the File: *.PWS footer. The values follow a Platt light curve and a Hill shaped NPQ
+response with per-run variation, so the calculated values and plots look like real experiments.
+With rawTraces the matching L_<date>_<time>.csv "Time;F;" trace with one saturation pulse per step
+is written as well.
+
+Run from the repository root:
+    python benchmarks/syntheticDataset.py synthetic_1000 1000 --raw-traces
+"""
+import argparse
+import datetime
+import os
+
+import numpy as np
+
+# The light steps of LightCurve_Marianne.lcp
+protocolPAR = np.array([0, 5, 8, 19, 32, 58, 124, 178, 245, 351, 470, 600, 754, 906, 1314])
+stepSeconds = 30
+# The instrument counts t in seconds since 30.12.1899
+instrumentEpoch = datetime.datetime(1899, 12, 30)
+header = '"t";"Date";"Time";"No.";"ML";"Temp.";"PAR";"F";"Fo\'";"Fm\'";"~Fo\'";"Y(II)";"NPQ";"ETR";"";'
+sampleTags = ["WT", "LHCX1g1", "LHCX1g2"]
+
+
+def simulateRuns(runCount, rng):
+    """Draws the fluorescence of every step of every run.
+
+    Returns:
+        dict of numpy arrays: Fo and Fm with one value per run, F, Fm', ~Fo', Y(II), NPQ and ETR with one row per run and one column per step.
+    """
+    Fo = rng.normal(0.46, 0.02, runCount)
+    Fm = Fo / (1 - rng.normal(0.70, 0.02, runCount))
+    # Platt light curve of the PSII yield, and a Hill shaped NPQ
+    alpha = rng.uniform(0.55, 0.8, runCount)[:, None]
+    ETRmax = rng.uniform(20, 35, runCount)[:, None]
+    beta = rng.uniform(0.0, 0.02, runCount)[:, None]
+    maxNPQ = rng.uniform(1.0, 2.0, runCount)[:, None]
+    halfNPQ = rng.uniform(250, 450, runCount)[:, None]
+    PAR = protocolPAR[None, :].astype(np.float64)
+    ETR = ETRmax * (1 - np.exp(-alpha * PAR / ETRmax)) * np.exp(-beta * PAR / ETRmax)
+    NPQ = maxNPQ * PAR**2 / (halfNPQ**2 + PAR**2) + np.abs(rng.normal(0, 0.01, ETR.shape))
+    # Fm' must stay above Fo, as in real samples, or PSII' and qP of the run make no sense
+    NPQ = np.minimum(NPQ, 0.9 * (Fm / Fo - 1)[:, None])
+    Fm_prime = Fm[:, None] / (1 + NPQ)
+    Fo_prime = Fo[:, None] / ((Fm[:, None] - Fo[:, None]) / Fm[:, None] + Fo[:, None] / Fm_prime)
+    # Y(II) can not be higher than the open reaction centres allow
+    maxYield = (Fm_prime - Fo_prime) / Fm_prime
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Y = np.where(PAR > 0, ETR / (0.84 * 0.5 * PAR), maxYield)
+    Y = np.clip(Y + rng.normal(0, 0.005, Y.shape), 0.0, maxYield)
+    F = Fm_prime * (1 - Y)
+    return {"Fo": Fo, "Fm": Fm, "F": F, "Fm'": Fm_prime, "~Fo'": Fo_prime, "Y(II)": Y, "NPQ": (Fm[:, None] - Fm_prime) / Fm_prime, "ETR": Y * PAR * 0.84 * 0.5}
+
+
+def formatRun(sampleName, start, values, runNumber):
+    """Writes the text of one run file, as the instrument does."""
+    t0 = int((start - instrumentEpoch).total_seconds())
+
+    def stamp(seconds):
+        moment = start + datetime.timedelta(seconds=seconds)
+        return f"{t0 + seconds};{moment:%d.%m.%y};{moment:%H:%M:%S}"
+
+    lines = [sampleName, header,
+             f"{stamp(0)};Type: LC ",
+             f"{stamp(1)};default_MC.par",
+             f"{stamp(1)};LightCurve_Marianne.lcp",
+             f"{stamp(0)};1;3; 0.0;0;Fo: {values['Fo'][runNumber]:.3f};Fm: {values['Fm'][runNumber]:.3f}"]
+    F, Fm_prime, Fo_prime, Y, NPQ, ETR = [values[column][runNumber] for column in ["F", "Fm'", "~Fo'", "Y(II)", "NPQ", "ETR"]]
+    for step, PAR in enumerate(protocolPAR):
+        lines.append(f"{stamp(step * stepSeconds)};{step + 1};3; 0.0;{PAR};{F[step]:.3f};0.000;{Fm_prime[step]:.3f};{Fo_prime[step]:.3f};{Y[step]:.3f};{NPQ[step]:.3f};{ETR[step]:5.1f};;")
+    endSeconds = (len(protocolPAR) - 1) * stepSeconds + 11
+    lines.append(f"{stamp(endSeconds)};File: {pwsStem(start)}.PWS")
+    return "\n".join(lines) + "\n"
+
+
+def pwsStem(start):
+    return f"L_{start:%y%m%d_%H%M%S}"
+
+
+def formatRawTrace(values, runNumber, rng, sampleInterval=0.01):
+    """Writes the "Time;F;" trace of one run: the steady state F of each step with a 0.8 s saturation pulse to Fm' at its start."""
+    stepCount = len(protocolPAR)
+    sampleCount = int(round((stepCount * stepSeconds + 10) / sampleInterval))
+    time = np.arange(1, sampleCount + 1) * sampleInterval
+    stepOfSample = np.minimum((time // stepSeconds).astype(np.int64), stepCount - 1)
+    F = values["F"][runNumber, stepOfSample].copy()
+    # The dark adapted first step sits at Fo between pulses
+    F[stepOfSample == 0] = values["Fo"][runNumber]
+    pulseStart = 1.0 + stepOfSample * stepSeconds
+    inPulse = (time >= pulseStart) & (time < pulseStart + 0.8)
+    F[inPulse] = values["Fm'"][runNumber, stepOfSample[inPulse]]
+    F = F + rng.normal(0, 0.001, sampleCount)
+    return "Time;F;\n" + "\n".join(f"{t:8.3f};{f:6.3f};" for t, f in zip(time, F)) + "\n"
+
+
+def generateExperiment(experimentDirectory, runCount, rawTraces=False, seed=0, start=datetime.datetime(2023, 3, 14, 8, 50, 26)):
+    """Writes an experiment directory with runCount light curve runs, and optionally their raw traces.
+
+    Args:
+        experimentDirectory (string): The directory to write, created if needed. Its last part is used in the file names like 20230314_1(1).CSV.
+        runCount (int): The number of runs.
+        rawTraces (bool, optional): Also write the raw trace of each run. Defaults to False.
+        seed (int, optional): The seed of the random values, the same seed gives the same files. Defaults to 0.
+        start (datetime, optional): The start of the first run, the runs follow each other 8 minutes apart. Defaults to 14.03.23 08:50:26.
+
+    Returns:
+        list of strings: The names of the run files written.
+    """
+    os.makedirs(experimentDirectory, exist_ok=True)
+    experimentName = os.path.basename(os.path.normpath(experimentDirectory))
+    rng = np.random.default_rng(seed)
+    values = simulateRuns(runCount, rng)
+    fileNames = []
+    for runNumber in range(runCount):
+        sampleTag = sampleTags[runNumber % len(sampleTags)]
+        sampleName = f"{sampleTag} {runNumber // len(sampleTags) + 1}.1.1"
+        runStart = start + datetime.timedelta(minutes=8 * runNumber)
+        fileName = f"{experimentName}_1({runNumber + 1}).CSV"
+        with open(os.path.join(experimentDirectory, fileName), "w") as f:
+            f.write(formatRun(sampleName, runStart, values, runNumber))
+        if rawTraces:
+            with open(os.path.join(experimentDirectory, f"{pwsStem(runStart)}.csv"), "w") as f:
+                f.write(formatRawTrace(values, runNumber, rng))
+        fileNames.append(fileName)
+    return fileNames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic PAM experiment directory.")
+    parser.add_argument("directory", help="The experiment directory to write.")
+    parser.add_argument("runs", type=int, help="The number of runs.")
+    parser.add_argument("--raw-traces", action="store_true", help="Also write the raw Time;F; trace of each run.")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the random values. Defaults to 0.")
+    args = parser.parse_args()
+    generateExperiment(args.directory, args.runs, rawTraces=args.raw_traces, seed=args.seed)
@@ -1,5 +1,14 @@
 import os
+import sys
+import glob
+import json
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+import argparse
 import PAMflourometryDataTransfom as dT
+import experimentWatcher
+import experimentStore
+import pipelineReport
 
 
 def takeYorN(inString):
@@ -93,6 +102,233 @@ def main():
         else:
             dT.mergeData(experimentDataDirectory, saveXLSX=makeXLSX, saveCSV=makeCSV)
 
-            
-            
-main()
+
+def expandExperimentDirectories(patterns):
+    """Expands the directories and glob patterns given on the command line into a sorted list of experiment directories.
+    The directories are made relative to the current directory, which is where the processing functions look for them.
+
+    Args:
+        patterns (list of strings): Directories or glob patterns (f.ex. "archive/2023*").
+
+    Returns:
+        list of strings: The experiment directories, without duplicates.
+    """
+    experimentDirectories = []
+    for pattern in patterns:
+        # Globs are expanded here as well, since not every shell (f.ex. cmd.exe) does it
+        matches = glob.glob(pattern) if glob.has_magic(pattern) else [pattern]
+        for match in sorted(matches):
+            if not os.path.isdir(match):
+                print(f"Skipping {match}: it is not a directory")
+                continue
+            experimentDirectory = os.path.relpath(match)
+            if experimentDirectory not in experimentDirectories:
+                experimentDirectories.append(experimentDirectory)
+    return experimentDirectories
+
+def findRepeatedExperimentNames(experimentDirectories):
+    """Finds experiment directories with the same name in different places (f.ex. archiveA/20230314 and archiveB/20230314).
+    The results of an experiment are named after its directory, so these would write over each other's results in myPAMresults.
+
+    Args:
+        experimentDirectories (list of strings): The experiment directories.
+
+    Returns:
+        dict: The directories of each name used more than once.
+    """
+    directoriesByName = {}
+    for experimentDirectory in experimentDirectories:
+        directoriesByName.setdefault(os.path.basename(os.path.normpath(experimentDirectory)), []).append(experimentDirectory)
+    return {experimentName: directories for experimentName, directories in directoriesByName.items() if len(directories) > 1}
+
+def buildArgumentParser():
+    parser = argparse.ArgumentParser(description="PAM data plotter and data collector. Run without arguments for the interactive questions.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    processParser = subparsers.add_parser("process", help="Merge and/or plot the data of one or more experiment directories.")
+    processParser.add_argument("directories", nargs="+", help="Experiment directories or glob patterns, f.ex. 20230314 'archive/2023*'.")
+    processParser.add_argument("--format", nargs="+", choices=["xlsx", "csv", "parquet", "sqlite"], default=[], help="The output formats of the merged data. sqlite adds the runs to the experiment store (see --database).")
+    processParser.add_argument("--database", default="myPAMresults/experiments.sqlite", help="The experiment store used by --format sqlite. Defaults to myPAMresults/experiments.sqlite.")
+    processParser.add_argument("--plot", action="store_true", help="Plot the data of each experiment.")
+    processParser.add_argument("--plot-dir", default=None, help="Save the plots to this directory instead of showing them. Works without a display.")
+    processParser.add_argument("--plot-format", choices=["png", "svg", "pdf"], default="png", help="The file format of the saved plots. Defaults to png.")
+    processParser.add_argument("--x-axis", nargs="+", default=["t"], help="The columns plotted on the x-axis. Defaults to t.")
+    processParser.add_argument("--y-axis", nargs="+", default=["NPQown", "rETR"], help="The columns plotted on the y-axis. Defaults to NPQown rETR.")
+    processParser.add_argument("--wildtype-tag", default="WT", help="A common section of all wildtype sample names. Defaults to WT.")
+    processParser.add_argument("--sample-tags", nargs="+", default=["LHCX1g1", "LHCX1g2"], help="Common roots of the sample names which should be grouped.")
+    processParser.add_argument("--group-stats", choices=["No.", "PAR", "t"], default=None, help="Save the mean, SD, SE and n of each tag group, lining the runs up on this column.")
+    processParser.add_argument("--plot-stats", action="store_true", help="Draw the mean ± SD band of each tag group instead of the separate runs in saved plots.")
+    processParser.add_argument("--light-curve", choices=["platt", "eilers-peeters"], default=None, help="Fit the rETR vs PAR light curve of every run with this model and save alpha, ETRmax, Ek and beta with the max values.")
+    processParser.add_argument("--workers", type=int, default=1, help="The number of worker processes used to read the files. Defaults to 1.")
+    processParser.add_argument("--cache", action="store_true", help="Only process the files that are new or changed since the last merge.")
+    processParser.add_argument("--progress", action="store_true", help="Print the time, rows and bytes of every file and stage as they finish.")
+    processParser.add_argument("--report", default=None, help="Save the time, rows and bytes of every file and stage to this JSON file.")
+    processParser.add_argument("--track-memory", action="store_true", help="Also record the peak memory of every stage (slower).")
+    processParser.add_argument("--profile", default=None, help="Save cProfile statistics of the whole command to this file.")
+    processParser.add_argument("--skip-bad-files", action="store_true", help="Leave out run files which can not be processed, listing them with the reason in myPAMresults/<experiment>_quarantine.json.")
+    processParser.add_argument("--checkpoint", default=None, help="Record the finished experiments in this JSON file, and skip the unchanged ones when run again with the same options, f.ex. after an interruption.")
+
+    watchParser = subparsers.add_parser("watch", help="Follow an experiment directory while the fluorometer writes to it.")
+    watchParser.add_argument("directory", help="The experiment directory to watch.")
+    watchParser.add_argument("--interval", type=float, default=0.5, help="The time in seconds between checking the directory. Defaults to 0.5.")
+    return parser
+
+def runCommandLine(argv):
+    """Runs the non-interactive command line, f.ex.
+        python consoleInterface.py process 2023* --format xlsx csv --workers 8
+        python consoleInterface.py watch 20230314
+
+    Args:
+        argv (list of strings): The command line arguments, without the program name.
+
+    Returns:
+        int: 0 if all experiment directories were processed, 1 otherwise.
+    """
+    args = buildArgumentParser().parse_args(argv)
+    if args.command == "watch":
+        experimentWatcher.watchExperiment(os.path.relpath(args.directory), pollInterval=args.interval)
+        return 0
+
+    experimentDirectories = expandExperimentDirectories(args.directories)
+    if not experimentDirectories:
+        print("No experiment directories found")
+        return 1
+    repeatedNames = findRepeatedExperimentNames(experimentDirectories)
+    if repeatedNames:
+        for experimentName, directories in repeatedNames.items():
+            print(f"The experiment directories {', '.join(directories)} are all named {experimentName}, so their results would overwrite each other in myPAMresults")
+        print("Process them in separate runs, moving the results of each run away before the next")
+        return 1
+    if not (args.format or args.plot):
+        print("Nothing to do: give --format and/or --plot")
+        return 1
+    # Only measure the processing when asked to
+    report = None
+    if args.progress or args.report is not None or args.track_memory:
+        report = pipelineReport.newPipelineReport(progressCallback=pipelineReport.printProgress if args.progress else None, trackMemory=args.track_memory)
+    if args.profile is not None:
+        failedExperiments = pipelineReport.profileCall(args.profile, processExperiments, experimentDirectories, args, report)
+    else:
+        failedExperiments = processExperiments(experimentDirectories, args, report)
+    if args.report is not None:
+        pipelineReport.writePipelineReport(report, args.report)
+    if failedExperiments:
+        print(f"Failed: {', '.join(failedExperiments)}")
+        return 1
+    return 0
+
+# The process options which do not change the results, and so do not make a checkpoint invalid
+checkpointIgnoredOptions = ["command", "directories", "workers", "progress", "report", "track_memory", "profile", "checkpoint"]
+
+def loadCheckpoint(checkpointPath, checkpointOptions):
+    """Loads the experiments finished by an earlier run with the same options.
+
+    Args:
+        checkpointPath (string): The checkpoint JSON file.
+        checkpointOptions (dict): The process options of this run which change the results.
+
+    Returns:
+        dict: The fingerprint (see dT.getExperimentFingerprint) of each finished experiment directory. Empty if there is no checkpoint or it was made with other options.
+    """
+    if not os.path.exists(checkpointPath):
+        return {}
+    with open(checkpointPath, "r") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("options") != checkpointOptions:
+        print(f"Not using {checkpointPath}: it was made with other options")
+        return {}
+    return checkpoint["experiments"]
+
+def saveCheckpoint(checkpointPath, checkpointOptions, finishedExperiments):
+    """Saves the finished experiments. The checkpoint is written to a temporary file first so an interrupted write can not corrupt it.
+
+    Args:
+        checkpointPath (string): The checkpoint JSON file.
+        checkpointOptions (dict): The process options of this run which change the results.
+        finishedExperiments (dict): The fingerprint of each finished experiment directory.
+    """
+    checkpointDirectory = os.path.dirname(checkpointPath)
+    if checkpointDirectory and not os.path.exists(checkpointDirectory):
+        os.makedirs(checkpointDirectory)
+    with open(checkpointPath + ".tmp", "w") as f:
+        json.dump({"options": checkpointOptions, "experiments": finishedExperiments}, f, indent=1)
+    os.replace(checkpointPath + ".tmp", checkpointPath)
+
+def processExperiments(experimentDirectories, args, report):
+    """Merges and/or plots each experiment directory as given by the process command line arguments.
+
+    An experiment which fails is reported and the next one is processed. With more than one worker all experiments share one pool of worker processes.
+
+    Returns:
+        list of strings: The experiment directories which failed.
+    """
+    checkpointOptions = {option: value for option, value in vars(args).items() if option not in checkpointIgnoredOptions}
+    finishedExperiments = {} if args.checkpoint is None else loadCheckpoint(args.checkpoint, checkpointOptions)
+    failedExperiments = []
+    with (ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else nullcontext()) as executor:
+        for experimentDataDirectory in experimentDirectories:
+            if processExperimentCheckpointed(experimentDataDirectory, args, report, executor, checkpointOptions, finishedExperiments) is False:
+                failedExperiments.append(experimentDataDirectory)
+    return failedExperiments
+
+def processExperimentCheckpointed(experimentDataDirectory, args, report, executor, checkpointOptions, finishedExperiments):
+    """Processes one experiment unless the checkpoint has it as finished, and records it in the checkpoint when it is done.
+
+    Returns:
+        bool: False if the experiment failed, True otherwise.
+    """
+    if args.checkpoint is not None:
+        experimentFingerprint = dT.getExperimentFingerprint(experimentDataDirectory)
+        if finishedExperiments.get(experimentDataDirectory) == experimentFingerprint:
+            print(f"Skipping {experimentDataDirectory}: finished in an earlier run and unchanged since")
+            return True
+    print(f"Processing {experimentDataDirectory}")
+    try:
+        processExperiment(experimentDataDirectory, args, report, executor)
+    except Exception as error:
+        hint = "" if args.skip_bad_files else " (--skip-bad-files leaves out the run files which can not be processed)"
+        print(f"Failed {experimentDataDirectory}: {type(error).__name__}: {error}{hint}")
+        return False
+    if args.checkpoint is not None:
+        finishedExperiments[experimentDataDirectory] = experimentFingerprint
+        saveCheckpoint(args.checkpoint, checkpointOptions, finishedExperiments)
+    return True
+
+def processExperiment(experimentDataDirectory, args, report, executor=None):
+    """Merges and/or plots one experiment directory as given by the process command line arguments.
+    The run files are read and calculated once, and the figure, merged files and store are all made from that."""
+    experimentName = os.path.basename(os.path.normpath(experimentDataDirectory))
+    quarantine = {} if args.skip_bad_files else None
+    # The store needs the file name and metadata of every run
+    runInfo = [] if "sqlite" in args.format else None
+    cacheDirectory = f"./myPAMresults/{experimentName}_cache" if args.cache else None
+    sampleNamesPerRun, runOffsets, calculatedPAMdata_df, calcValuesOut = dT.calculateExperiment(experimentDataDirectory, workers=args.workers, cacheDirectory=cacheDirectory, report=report, quarantine=quarantine, executor=executor, runInfo=runInfo)
+    dT.saveQuarantineList(experimentDataDirectory, quarantine)
+    dT.checkRunsLeft(experimentDataDirectory, len(sampleNamesPerRun), quarantine)
+    if args.light_curve is not None and args.format:
+        calcValuesOut = dT.addLightCurveFits(experimentDataDirectory, runOffsets, calculatedPAMdata_df, calcValuesOut, args.light_curve, report=report)
+
+    if args.plot:
+        if args.plot_dir is not None:
+            # Plots are saved as <plot-dir>/<experiment name>.<plot-format> if a plot directory is given
+            plotPath = os.path.join(args.plot_dir, f"{experimentName}.{args.plot_format}")
+            dT.saveExperimentFigure(experimentDataDirectory, sampleNamesPerRun, runOffsets, calculatedPAMdata_df, plotPath, x_axis=args.x_axis, y_axis=args.y_axis, wildtypeTag=args.wildtype_tag, sampleTags=args.sample_tags, showGroupStatistics=args.plot_stats, report=report)
+        else:
+            dT.showExperimentFigure(sampleNamesPerRun, runOffsets, calculatedPAMdata_df, x_axis=args.x_axis, y_axis=args.y_axis, wildtypeTag=args.wildtype_tag, sampleTags=args.sample_tags)
+    if args.format:
+        # Group statistics are only calculated when asked for
+        groupTags = {}
+        if args.group_stats is not None:
+            groupTags = {"wildtypeTag": args.wildtype_tag, "sampleTags": args.sample_tags, "groupStatisticsAlignOn": args.group_stats}
+        if {"xlsx", "csv", "parquet"} & set(args.format):
+            dT.writeMergedData(experimentDataDirectory, sampleNamesPerRun, runOffsets, calculatedPAMdata_df, calcValuesOut, saveXLSX="xlsx" in args.format, saveCSV="csv" in args.format, saveParquet="parquet" in args.format, report=report, **groupTags)
+        if "sqlite" in args.format:
+            experimentStore.storeExperimentRuns(args.database, experimentDataDirectory, runInfo, sampleNamesPerRun, runOffsets, calculatedPAMdata_df, calcValuesOut, report=report)
+
+
+if __name__ == "__main__":
+    # With arguments run the command line, without them ask the questions
+    if len(sys.argv) > 1:
+        sys.exit(runCommandLine(sys.argv[1:]))
+    else:
+        main()
@@ -0,0 +1,292 @@
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+import PAMflourometryDataTransfom as dT
+import pipelineReport
+
+# The columns of the run data table. Columns an experiment does not have are stored as NULL, other numeric columns of the instrument (f.ex. Y(NPQ), qN) go to runDataExtra
+runDataColumns = ["index", "t", "No.", "ML", "Temp.", "PAR", "F", "Fo'", "Fm'", "~Fo'", "Y(II)", "NPQ", "ETR", "NPQown", "PSII'", "qP", "rETR"]
+maxValuesColumns = ["max_Fm", "max_NPQ", "max_Fo", "max_PSII", "alpha", "ETRmax", "Ek", "beta", "fitRMSE"]
+
+def quoteName(name):
+    """Quotes a column name for SQL, the PAM column names contain characters like ' . ~ ( )."""
+    return '"' + name.replace('"', '""') + '"'
+
+def getExperimentKey(experimentID):
+    """Returns the key of an experiment in the store: its normalized absolute path, so directories with the same name in different places are kept apart.
+
+    Args:
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+
+    Returns:
+        string: The normalized absolute path of the directory.
+    """
+    return os.path.normcase(os.path.abspath(experimentID))
+
+def connectStore(databasePath):
+    """Opens the experiment store, creating the file, the tables and the indexes if they do not exist yet.
+
+    The store has five tables:
+        runs: one row per run file with its experiment (key and directory name), sample names, date, time, type, .par/.lcp/.PWS file names and Fo/Fm.
+        runSamples: one row per sample ID of each run, so runs with several samples can be found by any of them.
+        runData: the (calculated) data rows of each run, with the columns in runDataColumns.
+        runDataExtra: the values of the other numeric columns of the data rows, one row per run, data row and column.
+        maxValues: the max values of each run and, if fitted, its light curve parameters.
+
+    Args:
+        databasePath (string): The path of the SQLite database file.
+
+    Returns:
+        sqlite3 Connection: The open connection. Close it when done.
+    """
+    databaseDirectory = os.path.dirname(databasePath)
+    if databaseDirectory:
+        dT.createDirectoryIfNotPresent(databaseDirectory)
+    connection = sqlite3.connect(databasePath)
+    # Deleting a run deletes its samples, data and max values
+    connection.execute("PRAGMA foreign_keys = ON")
+    runDataColumnDefinitions = ", ".join(f"{quoteName(column)} REAL" for column in runDataColumns[1:])
+    maxValuesColumnDefinitions = ", ".join(f"{quoteName(column)} REAL" for column in maxValuesColumns)
+    connection.executescript(f"""
+        CREATE TABLE IF NOT EXISTS runs (
+            runID INTEGER PRIMARY KEY,
+            experimentID TEXT NOT NULL,
+            experimentName TEXT,
+            fileName TEXT NOT NULL,
+            sampleName TEXT,
+            date TEXT,
+            time TEXT,
+            type TEXT,
+            parFile TEXT,
+            protocolFile TEXT,
+            pwsFile TEXT,
+            Fo REAL,
+            Fm REAL,
+            UNIQUE (experimentID, fileName)
+        );
+        CREATE TABLE IF NOT EXISTS runSamples (
+            runID INTEGER NOT NULL REFERENCES runs(runID) ON DELETE CASCADE,
+            sampleID TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS runData (
+            runID INTEGER NOT NULL REFERENCES runs(runID) ON DELETE CASCADE,
+            "index" INTEGER NOT NULL,
+            {runDataColumnDefinitions},
+            PRIMARY KEY (runID, "index")
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS runDataExtra (
+            runID INTEGER NOT NULL REFERENCES runs(runID) ON DELETE CASCADE,
+            "index" INTEGER NOT NULL,
+            columnName TEXT NOT NULL,
+            value REAL,
+            PRIMARY KEY (runID, "index", columnName)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS maxValues (
+            runID INTEGER PRIMARY KEY REFERENCES runs(runID) ON DELETE CASCADE,
+            {maxValuesColumnDefinitions}
+        );
+        CREATE INDEX IF NOT EXISTS runsSampleName ON runs (sampleName);
+        CREATE INDEX IF NOT EXISTS runsDate ON runs (date);
+        CREATE INDEX IF NOT EXISTS runsType ON runs (type);
+        CREATE INDEX IF NOT EXISTS runsProtocolFile ON runs (protocolFile);
+        CREATE INDEX IF NOT EXISTS runSamplesSampleID ON runSamples (sampleID);
+        CREATE INDEX IF NOT EXISTS runSamplesRunID ON runSamples (runID);
+    """)
+    return connection
+
+def convertRunDate(date):
+    """Converts the instrument's dd.mm.yy date to an ISO yyyy-mm-dd date, which sorts and compares correctly as text.
+
+    Args:
+        date (string): The date as written by the instrument, f.ex. "14.03.23". May be None.
+
+    Returns:
+        string: The ISO date, f.ex. "2023-03-14", or the original value if it can not be read.
+    """
+    if date is None:
+        return None
+    try:
+        return pd.to_datetime(date, format="%d.%m.%y").strftime("%Y-%m-%d")
+    except ValueError:
+        return date
+
+def importExperiment(databasePath, experimentID, workers=1, lightCurveModel=None, report=None, skipBadFiles=False, executor=None):
+    """Reads and calculates all run files of an experiment and stores them in the experiment store.
+    Runs of the experiment which are already in the store are replaced, so an experiment can be imported again after new runs were added.
+
+    Args:
+        databasePath (string): The path of the SQLite database file.
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored. The store keys the experiment on its normalized path (see getExperimentKey).
+        workers (int, optional): The number of worker processes used to read the files. Defaults to 1.
+        lightCurveModel (string, optional): If "platt" or "eilers-peeters", the light curve parameters of each run are stored with the max values. Defaults to None.
+        report (dict, optional): A report from pipelineReport.newPipelineReport, which gets the measurements of each file and of the database write. Defaults to None.
+        skipBadFiles (bool, optional): Leave out the run files which fail their checks (see dT.mapFiles) instead of stopping the import. Defaults to False.
+        executor (concurrent.futures.Executor, optional): A process pool shared by several calls, used instead of starting a pool of workers for these files. Defaults to None.
+
+    Returns:
+        int: The number of runs stored.
+    """
+    quarantine = {} if skipBadFiles else None
+    # The store needs the file name and metadata of every run
+    runInfo = []
+    sampleNamesPerRun, runOffsets, calculatedPAMdata_df, calcValuesOut = dT.calculateExperimentBatch(experimentID, workers=workers, report=report, quarantine=quarantine, executor=executor, runInfo=runInfo)
+    dT.saveQuarantineList(experimentID, quarantine)
+    dT.checkRunsLeft(experimentID, len(sampleNamesPerRun), quarantine)
+    if lightCurveModel is not None:
+        calcValuesOut = dT.addLightCurveFits(experimentID, runOffsets, calculatedPAMdata_df, calcValuesOut, lightCurveModel, report=report)
+    return storeExperimentRuns(databasePath, experimentID, runInfo, sampleNamesPerRun, runOffsets, calculatedPAMdata_df, calcValuesOut, report=report)
+
+def storeExperimentRuns(databasePath, experimentID, runInfo, sampleNamesPerRun, runOffsets, calculatedPAMdata_df, calcValuesOut, report=None):
+    """Stores runs which are already calculated (see dT.calculateExperiment) in the experiment store, replacing the runs the experiment had in it.
+
+    Args:
+        databasePath (string): The path of the SQLite database file.
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+        runInfo (list of tuples): The (fileName, runMetadata) of each run, as collected by dT.calculateExperiment.
+        sampleNamesPerRun (list of lists of strings): The sample names of each run.
+        runOffsets (numpy array of ints): The row number of the first row of each run.
+        calculatedPAMdata_df (pandas DataFrame): The data of all runs after each other.
+        calcValuesOut (pandas DataFrame): The max values (and light curve parameters) of each run.
+        report (dict, optional): A report from pipelineReport.newPipelineReport, which gets the measurements of the database write. Defaults to None.
+
+    Returns:
+        int: The number of runs stored.
+    """
+    experimentKey = getExperimentKey(experimentID)
+    experimentName = os.path.basename(os.path.normpath(experimentID))
+    connection = connectStore(databasePath)
+    try:
+        with pipelineReport.measureStage(report, "writeSQLite", experimentName) as stage, connection:
+            connection.execute("DELETE FROM runs WHERE experimentID = ?", (experimentKey,))
+            runIDs = []
+            for (fileName, runMetadata), listOfSampleNames in zip(runInfo, sampleNamesPerRun):
+                cursor = connection.execute(
+                    "INSERT INTO runs (experimentID, experimentName, fileName, sampleName, date, time, type, parFile, protocolFile, pwsFile, Fo, Fm) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (experimentKey, experimentName, fileName, ", ".join(listOfSampleNames), convertRunDate(runMetadata["date"]), runMetadata["time"], runMetadata["type"],
+                     runMetadata["parFile"], runMetadata["protocolFile"], runMetadata["pwsFile"], runMetadata["Fo"], runMetadata["Fm"]))
+                runIDs.append(cursor.lastrowid)
+                connection.executemany("INSERT INTO runSamples (runID, sampleID) VALUES (?, ?)", [(cursor.lastrowid, sampleID.strip()) for sampleID in listOfSampleNames])
+
+            if runIDs:
+                # The data rows of all runs in one insert, with the run ID of each row in front
+                runLengths = np.diff(np.append(runOffsets, len(calculatedPAMdata_df)))
+                runData_df = dT.decimalFloatColumns(calculatedPAMdata_df.reindex(columns=runDataColumns))
+                # The row number of each row within its run
+                runData_df["index"] = np.arange(len(calculatedPAMdata_df)) - np.repeat(runOffsets, runLengths)
+                runData_df.insert(0, "runID", np.repeat(runIDs, runLengths))
+                connection.executemany(
+                    f"INSERT INTO runData ({', '.join(quoteName(column) for column in runData_df.columns)}) VALUES ({', '.join('?' * len(runData_df.columns))})",
+                    runData_df.astype(object).where(runData_df.notna(), None).itertuples(index=False, name=None))
+                # The other numeric columns in long format, leaving out the empty values
+                extraColumns = [column for column in calculatedPAMdata_df.columns if column not in runDataColumns
+                                and pd.api.types.is_numeric_dtype(calculatedPAMdata_df[column]) and not pd.api.types.is_bool_dtype(calculatedPAMdata_df[column])]
+                if extraColumns:
+                    extraData_df = dT.decimalFloatColumns(calculatedPAMdata_df.loc[:, extraColumns])
+                    extraData_df.insert(0, "index", runData_df["index"].to_numpy())
+                    extraData_df.insert(0, "runID", runData_df["runID"].to_numpy())
+                    extraData_df = extraData_df.melt(id_vars=["runID", "index"], var_name="columnName", value_name="value").dropna(subset=["value"])
+                    connection.executemany(
+                        'INSERT INTO runDataExtra (runID, "index", columnName, value) VALUES (?, ?, ?, ?)',
+                        extraData_df.astype(object).itertuples(index=False, name=None))
+                maxValues_df = dT.decimalFloatColumns(calcValuesOut.reindex(columns=maxValuesColumns))
+                maxValues_df.insert(0, "runID", runIDs)
+                connection.executemany(
+                    f"INSERT INTO maxValues ({', '.join(quoteName(column) for column in maxValues_df.columns)}) VALUES ({', '.join('?' * len(maxValues_df.columns))})",
+                    maxValues_df.astype(object).where(maxValues_df.notna(), None).itertuples(index=False, name=None))
+            stage["rows"] = len(calculatedPAMdata_df)
+    finally:
+        connection.close()
+    return len(runIDs)
+
+def buildRunFilter(experimentID=None, sampleID=None, dateFrom=None, dateTo=None, runType=None, protocolFile=None):
+    """Builds the WHERE clause selecting runs in the runs table (aliased "runs").
+
+    Returns:
+        string: The WHERE clause, empty if no filter is given.
+        list: The values of the ? placeholders in the clause.
+    """
+    conditions = []
+    parameters = []
+    if experimentID is not None:
+        conditions.append("runs.experimentID = ?")
+        parameters.append(getExperimentKey(experimentID))
+    if sampleID is not None:
+        conditions.append("runs.runID IN (SELECT runID FROM runSamples WHERE sampleID = ?)")
+        parameters.append(sampleID)
+    if dateFrom is not None:
+        conditions.append("runs.date >= ?")
+        parameters.append(dateFrom)
+    if dateTo is not None:
+        conditions.append("runs.date <= ?")
+        parameters.append(dateTo)
+    if runType is not None:
+        conditions.append("runs.type = ?")
+        parameters.append(runType)
+    if protocolFile is not None:
+        conditions.append("runs.protocolFile = ?")
+        parameters.append(protocolFile)
+    if not conditions:
+        return "", parameters
+    return "WHERE " + " AND ".join(conditions), parameters
+
+def queryRuns(databasePath, experimentID=None, sampleID=None, dateFrom=None, dateTo=None, runType=None, protocolFile=None):
+    """Returns the runs in the experiment store which match all of the given filters, with their metadata and max values.
+
+    Args:
+        databasePath (string): The path of the SQLite database file.
+        experimentID (string, optional): Only runs of this experiment, given by its path as when it was imported (see getExperimentKey). Defaults to None.
+        sampleID (string, optional): Only runs containing this sample, f.ex. "WT 1.1.1". Defaults to None.
+        dateFrom (string, optional): Only runs on or after this yyyy-mm-dd date. Defaults to None.
+        dateTo (string, optional): Only runs on or before this yyyy-mm-dd date. Defaults to None.
+        runType (string, optional): Only runs of this type, f.ex. "LC". Defaults to None.
+        protocolFile (string, optional): Only runs using this .lcp protocol file. Defaults to None.
+
+    Returns:
+        pandas DataFrame: One row per run.
+    """
+    whereClause, parameters = buildRunFilter(experimentID, sampleID, dateFrom, dateTo, runType, protocolFile)
+    maxValuesSelection = ", ".join(f"maxValues.{quoteName(column)}" for column in maxValuesColumns)
+    return querySQL(databasePath, f"SELECT runs.*, {maxValuesSelection} FROM runs LEFT JOIN maxValues ON maxValues.runID = runs.runID {whereClause} ORDER BY runs.date, runs.time, runs.runID", parameters)
+
+def queryRunData(databasePath, columns=None, experimentID=None, sampleID=None, dateFrom=None, dateTo=None, runType=None, protocolFile=None):
+    """Returns the data rows of the runs in the experiment store which match all of the given filters (see queryRuns).
+
+    Args:
+        databasePath (string): The path of the SQLite database file.
+        columns (list of strings, optional): The data columns to return, f.ex. ["t", "PAR", "NPQown", "Y(NPQ)"]. Columns which are not in runDataColumns
+            are read from runDataExtra and are NULL for runs without them. Defaults to None (all of runDataColumns and every column in runDataExtra).
+
+    Returns:
+        pandas DataFrame: The data rows with the runID, experimentID and sampleName of their run in front.
+    """
+    if columns is None:
+        extraColumns = list(querySQL(databasePath, "SELECT DISTINCT columnName FROM runDataExtra ORDER BY columnName")["columnName"])
+        columns = runDataColumns + [column for column in extraColumns if column not in runDataColumns]
+    whereClause, filterParameters = buildRunFilter(experimentID, sampleID, dateFrom, dateTo, runType, protocolFile)
+    dataSelection = []
+    parameters = []
+    for column in columns:
+        if column in runDataColumns:
+            dataSelection.append(f"runData.{quoteName(column)}")
+        else:
+            dataSelection.append(f'(SELECT value FROM runDataExtra WHERE runDataExtra.runID = runData.runID AND runDataExtra."index" = runData."index" AND columnName = ?) AS {quoteName(column)}')
+            parameters.append(column)
+    return querySQL(databasePath, f"SELECT runs.runID, runs.experimentID, runs.sampleName, {', '.join(dataSelection)} FROM runs JOIN runData ON runData.runID = runs.runID {whereClause} ORDER BY runs.runID, runData.\"index\"", parameters + filterParameters)
+
+def querySQL(databasePath, sql, parameters=()):
+    """Runs any SELECT statement on the experiment store, f.ex. to combine the tables in a way queryRuns and queryRunData do not.
+
+    Args:
+        databasePath (string): The path of the SQLite database file.
+        sql (string): The SQL statement, with ? placeholders for the parameters.
+        parameters (list, optional): The values of the placeholders. Defaults to ().
+
+    Returns:
+        pandas DataFrame: The result of the statement.
+    """
+    connection = connectStore(databasePath)
+    try:
+        return pd.read_sql_query(sql, connection, params=list(parameters))
+    finally:
+        connection.close()
@@ -0,0 +1,192 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from io import StringIO
+import PAMflourometryDataTransfom as dT
+
+def newRunState():
+    """Returns the state kept for a run file while it is being watched.
+
+    Returns:
+        dict: The read offset, the unfinished last line, the header, sample names, metadata, data and max values of the run,
+        and why the run could not be processed ("failure") along with the size of the file at that time ("failedSize").
+    """
+    return {"offset": 0, "pendingText": "", "headerLine": None, "local_ID_list": [], "metadata": None, "data_df": None, "max_Fm": None, "max_Fo": None, "failure": None, "failedSize": None}
+
+def readNewLines(filePath, runState):
+    """Reads the bytes written to a run file since the last call. Only complete lines are returned,
+    an unfinished last line is kept in the run state until the instrument has written the rest of it.
+
+    Args:
+        filePath (string): The path of the run file.
+        runState (dict): The state of the run as returned by newRunState.
+
+    Returns:
+        list of strings: The new complete lines.
+    """
+    with open(filePath, "r") as f:
+        f.seek(runState["offset"])
+        newText = f.read()
+        runState["offset"] = f.tell()
+    text = runState["pendingText"] + newText
+    lastLineEnd = text.rfind("\n")
+    runState["pendingText"] = text[lastLineEnd + 1:]
+    if lastLineEnd == -1:
+        return []
+    return [line.rstrip("\r") for line in text[:lastLineEnd].split("\n")]
+
+def updateRun(runState, newLines):
+    """Adds the new lines of a run file to the run state: the sample names, header and metadata lines are parsed as in
+    readPAMfile, and only the new data rows are parsed and calculated. Rows already calculated are only recalculated if
+    a new row raises the max Fm' or max ~Fo' of the run.
+
+    Args:
+        runState (dict): The state of the run as returned by newRunState.
+        newLines (list of strings): The new complete lines of the run file.
+
+    Returns:
+        pandas DataFrame: The rows whose calculated values changed (the new rows, or the whole run if the max values changed). Empty if no data rows were added.
+        pandas Series: The max values of the run, or None if the run has no data rows yet.
+
+    Raises:
+        ValueError: If the column header is missing one of the columns in dT.requiredRunColumns.
+    """
+    if runState["metadata"] is None:
+        runState["metadata"] = {"date": None, "time": None, "type": None, "parFile": None, "protocolFile": None, "Fo": None, "Fm": None, "pwsFile": None, "metadataLines": []}
+    dataLines = []
+    for line in newLines:
+        if line.strip() == "":
+            continue
+        if runState["headerLine"] is None:
+            # The column header is the first line starting with the "t" column, anything before it is the sample name line
+            if line.startswith('"t"'):
+                headerColumns = [column.strip('"') for column in line.split(";")]
+                missingColumns = [column for column in dT.requiredRunColumns if column not in headerColumns]
+                if missingColumns:
+                    raise ValueError(f"the header is missing the column(s) {', '.join(missingColumns)}")
+                runState["headerLine"] = line
+            else:
+                runState["local_ID_list"] = line.split(",")
+        elif line.count(";") == runState["headerLine"].count(";"):
+            # Data rows have exactly as many fields as the header
+            dataLines.append(line)
+        else:
+            dT.parseMetadataLine(line, runState["metadata"])
+
+    if not dataLines:
+        return pd.DataFrame(), getMaxValues(runState)
+
+    # Parse only the new data rows with the C engine and drop the empty columns at the end of each row
+    newRows_df = pd.read_csv(StringIO(runState["headerLine"] + "\n" + "\n".join(dataLines)), delimiter=";")
+    newRows_df = newRows_df.loc[:, [column for column in newRows_df.columns if not column.startswith("Unnamed:")]]
+    previousRowCount = 0 if runState["data_df"] is None else len(runState["data_df"])
+    newRows_df.index = range(previousRowCount, previousRowCount + len(newRows_df))
+
+    # Only recalculate the whole run if the new rows change its max values
+    max_Fm = newRows_df["Fm'"].max() if runState["max_Fm"] is None else max(runState["max_Fm"], newRows_df["Fm'"].max())
+    max_Fo = newRows_df["~Fo'"].max() if runState["max_Fo"] is None else max(runState["max_Fo"], newRows_df["~Fo'"].max())
+    if runState["data_df"] is not None and (max_Fm != runState["max_Fm"] or max_Fo != runState["max_Fo"]):
+        runState["data_df"] = dT.injectCalculatedValues(dT.stackRunFrames([runState["data_df"], newRows_df]), max_Fm, max_Fo)
+        updatedRows_df = runState["data_df"]
+    else:
+        updatedRows_df = dT.injectCalculatedValues(newRows_df, max_Fm, max_Fo)
+        runState["data_df"] = updatedRows_df if runState["data_df"] is None else dT.stackRunFrames([runState["data_df"], updatedRows_df])
+    runState["max_Fm"] = max_Fm
+    runState["max_Fo"] = max_Fo
+    return updatedRows_df, getMaxValues(runState)
+
+def getMaxValues(runState):
+    """Returns the max values of a watched run in the same form as calculateValuesAndInject.
+
+    Args:
+        runState (dict): The state of the run as returned by newRunState.
+
+    Returns:
+        pandas Series: The max values for Fm, NPQ, Fo, and PSII, or None if the run has no data rows yet.
+    """
+    if runState["data_df"] is None:
+        return None
+    max_Fm = np.float64(runState["max_Fm"])
+    max_Fo = np.float64(runState["max_Fo"])
+    return pd.Series([max_Fm, runState["data_df"]["NPQown"].max(), max_Fo, (max_Fm - max_Fo)/max_Fm], index=["max_Fm", "max_NPQ", "max_Fo", "max_PSII"], name=", ".join(runState["local_ID_list"]), dtype=np.float32)
+
+def printRunUpdate(fileName, local_ID_list, updatedRows_df, maxValues_Series):
+    """The default callback of watchExperiment, prints the new NPQown and rETR values of a run.
+
+    Args:
+        fileName (string): The name of the run file.
+        local_ID_list (list of strings): The sample names of the run.
+        updatedRows_df (pandas DataFrame): The rows whose calculated values changed.
+        maxValues_Series (pandas Series): The max values of the run.
+    """
+    print(f"{fileName} ({', '.join(local_ID_list)}):")
+    print(updatedRows_df.loc[:, ["t", "PAR", "NPQown", "rETR"]].to_string(header=True))
+
+def printRunFailure(fileName, failureReason):
+    """The default failure callback of watchExperiment, prints why a run file can not be processed.
+
+    Args:
+        fileName (string): The name of the run file.
+        failureReason (string): Why the file can not be processed.
+    """
+    print(f"Skipping {fileName}: {failureReason}")
+
+def watchExperiment(experimentID, pollInterval=0.5, callback=printRunUpdate, filesIdentifier=").CSV", maxPolls=None, failureCallback=printRunFailure):
+    """Watches an experiment directory and processes the run files as the fluorometer writes them. The directory is polled
+    every pollInterval seconds for new files and files that have grown, and only the bytes added since the last poll are read.
+    A file that shrinks (f.ex. is overwritten) is read again from the start. A file which can not be processed is reported
+    and skipped, and tried again from the start once its size changes, while the other files are still followed.
+
+    Args:
+        experimentID (string): The path/folder/directory name of the directory where your PAM data is stored.
+        pollInterval (float, optional): The time in seconds between checking the directory. Defaults to 0.5.
+        callback (function, optional): Called as callback(fileName, local_ID_list, updatedRows_df, maxValues_Series) whenever a run gets new data rows. Defaults to printRunUpdate.
+        filesIdentifier (str, optional): A identifiable string present in the names of the run files. Defaults to ").CSV".
+        maxPolls (int, optional): Stop after this many polls. Runs until interrupted (Ctrl+C) if None. Defaults to None.
+        failureCallback (function, optional): Called as failureCallback(fileName, failureReason) when a file can not be processed. A file failing again
+            for the same reason is not reported again. Defaults to printRunFailure.
+
+    Returns:
+        dict: The state of every watched run by file name, including its calculated data in "data_df".
+    """
+    runStates = {}
+    pollCount = 0
+    try:
+        while maxPolls is None or pollCount < maxPolls:
+            fileNamesSeries, experimentPath = dT.getCSVfilesList(experimentID, filesIdentifier=filesIdentifier)
+            for fileName in fileNamesSeries:
+                filePath = f"{experimentPath}{fileName}"
+                runState = runStates.get(fileName)
+                previousFailure = None if runState is None else runState["failure"]
+                fileSize = None
+                try:
+                    fileSize = os.path.getsize(filePath)
+                    # Files which failed are only tried again once they have changed
+                    if runState is not None and runState["failure"] is not None and fileSize == runState["failedSize"]:
+                        continue
+                    # Start over with new files, files which failed and files which have been overwritten with something shorter
+                    if runState is None or runState["failure"] is not None or fileSize < runState["offset"]:
+                        runState = newRunState()
+                        runStates[fileName] = runState
+                    if fileSize == runState["offset"]:
+                        continue
+                    updatedRows_df, maxValues_Series = updateRun(runState, readNewLines(filePath, runState))
+                except Exception as error:
+                    # One bad file must not end the watch, the other runs are still followed
+                    failureReason = f"{type(error).__name__}: {error}"
+                    runState = newRunState()
+                    runState["failure"] = failureReason
+                    runState["failedSize"] = fileSize
+                    runStates[fileName] = runState
+                    if failureReason != previousFailure and failureCallback is not None:
+                        failureCallback(fileName, failureReason)
+                    continue
+                if len(updatedRows_df) > 0 and callback is not None:
+                    callback(fileName, runState["local_ID_list"], updatedRows_df, maxValues_Series)
+            pollCount += 1
+            if maxPolls is None or pollCount < maxPolls:
+                time.sleep(pollInterval)
+    except KeyboardInterrupt:
+        pass
+    return runStates
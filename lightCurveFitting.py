@@ -0,0 +1,246 @@
+import numpy as np
+import pandas as pd
+
+def stackRuns(values, runOffsets, totalRows):
+    """Puts runs that are stored after each other into a padded 2D array with one row per run.
+
+    Args:
+        values (numpy array): The values of all runs after each other.
+        runOffsets (numpy array of ints): The index of the first value of each run, in increasing order.
+        totalRows (int): The total number of values (the end of the last run).
+
+    Returns:
+        numpy array (float64): A (runs, longest run) array, padded with NaN.
+    """
+    runLengths = np.diff(np.append(runOffsets, totalRows))
+    stacked = np.full((len(runOffsets), max(1, runLengths.max(initial=0))), np.nan)
+    # The position of every value within its run
+    positions = np.arange(totalRows) - np.repeat(runOffsets, runLengths)
+    stacked[np.repeat(np.arange(len(runOffsets)), runLengths), positions] = values
+    return stacked
+
+def plattModel(PAR, logParameters):
+    """The Platt et al. (1980) light curve, ETR = Ps (1 - exp(-alpha PAR/Ps)) exp(-beta PAR/Ps), and its derivatives
+    with respect to the logarithms of Ps, alpha and beta. Working with the logarithms keeps all parameters positive.
+
+    Args:
+        PAR (numpy array): A (runs, steps) array of light intensities.
+        logParameters (numpy array): A (runs, 3) array of log(Ps), log(alpha) and log(beta).
+
+    Returns:
+        numpy array: The modelled ETR, shaped like PAR.
+        numpy array: The (runs, steps, 3) Jacobian with respect to the log parameters.
+    """
+    Ps, alpha, beta = [np.exp(logParameters[:, k])[:, None] for k in range(3)]
+    x = PAR / Ps
+    alphaTerm = np.exp(-alpha * x)
+    A = 1 - alphaTerm
+    B = np.exp(-beta * x)
+    ETR = Ps * A * B
+    # Derivatives with respect to Ps, alpha and beta
+    dPs = A*B - B*alpha*x*alphaTerm + A*B*beta*x
+    dAlpha = B * PAR * alphaTerm
+    dBeta = -A * B * PAR
+    # Chain rule for the log parameters: d/dlog(p) = p * d/dp
+    jacobian = np.stack([dPs * Ps, dAlpha * alpha, dBeta * beta], axis=-1)
+    return ETR, jacobian
+
+def fitBatchLevenbergMarquardt(model, PAR, ETR, parameters, maxIterations = 500, tolerance = 1e-10):
+    """Fits a light curve model to many light curves at once with a Levenberg-Marquardt least squares fit in ETR.
+    Every iteration updates all runs together with batched solves, each run keeping its own damping factor.
+
+    Args:
+        model (function): Called as model(PAR, parameters), returns the modelled ETR and the (runs, steps, parameters) Jacobian.
+        PAR (numpy array): A (runs, steps) array of light intensities, padded with NaN.
+        ETR (numpy array): A (runs, steps) array of electron transport rates, padded with NaN.
+        parameters (numpy array): A (runs, parameters) array of starting values.
+        maxIterations (int, optional): The largest number of iterations. Defaults to 500.
+        tolerance (float, optional): A run has converged when its relative change in squared error is below this, or its parameters stop changing. Defaults to 1e-10.
+
+    Returns:
+        numpy array: The fitted (runs, parameters) array.
+        numpy array (bool): Whether each fit converged.
+        numpy array: The root mean square error of each fit.
+    """
+    isValid = np.isfinite(PAR) & np.isfinite(ETR)
+    PAR = np.where(isValid, PAR, 0.0)
+    ETR = np.where(isValid, ETR, 0.0)
+    runCount, parameterCount = parameters.shape
+
+    damping = np.full(runCount, 1e-3)
+    converged = np.zeros(runCount, dtype=bool)
+    modelETR, jacobian = model(PAR, parameters)
+    residuals = np.where(isValid, modelETR - ETR, 0.0)
+    cost = np.sum(residuals**2, axis=1)
+    for iteration in range(maxIterations):
+        active = ~converged
+        if not active.any():
+            break
+        jacobian = np.where(isValid[:, :, None], jacobian, 0.0)
+        # Normal equations of all runs at once
+        JTJ = np.einsum("rnk,rnl->rkl", jacobian, jacobian)
+        JTr = np.einsum("rnk,rn->rk", jacobian, residuals)
+        dampedJTJ = JTJ + damping[:, None, None] * (np.eye(parameterCount)[None, :, :] * (np.diagonal(JTJ, axis1=1, axis2=2)[:, :, None] + 1e-12))
+        step = -np.linalg.solve(dampedJTJ, JTr[:, :, None])[:, :, 0]
+        # Keep the steps small enough for exp() to stay finite
+        step = np.clip(np.nan_to_num(step), -5, 5)
+        trialParameters = np.where(active[:, None], parameters + step, parameters)
+        trialModel, trialJacobian = model(PAR, trialParameters)
+        trialResiduals = np.where(isValid, trialModel - ETR, 0.0)
+        trialCost = np.sum(trialResiduals**2, axis=1)
+        # Accept the steps which lowered the squared error and relax their damping, increase the damping of the others
+        improved = active & np.isfinite(trialCost) & (trialCost < cost)
+        converged |= improved & (((cost - trialCost) <= tolerance * cost) | (np.abs(step).max(axis=1) < 1e-8))
+        converged |= active & ~improved & (damping > 1e10)
+        parameters = np.where(improved[:, None], trialParameters, parameters)
+        residuals = np.where(improved[:, None], trialResiduals, residuals)
+        jacobian = np.where(improved[:, None, None], trialJacobian, jacobian)
+        cost = np.where(improved, trialCost, cost)
+        damping = np.where(improved, damping / 3, damping * 3)
+
+    pointCount = np.maximum(isValid.sum(axis=1), 1)
+    return parameters, converged, np.sqrt(cost / pointCount)
+
+def fitPlattBatch(PAR, ETR, maxIterations = 500, tolerance = 1e-10):
+    """Fits the Platt model to many light curves at once with fitBatchLevenbergMarquardt.
+
+    Args:
+        PAR (numpy array): A (runs, steps) array of light intensities, padded with NaN.
+        ETR (numpy array): A (runs, steps) array of electron transport rates, padded with NaN.
+        maxIterations (int, optional): The largest number of iterations. Defaults to 500.
+        tolerance (float, optional): A run has converged when its relative change in squared error is below this, or its parameters stop changing. Defaults to 1e-10.
+
+    Returns:
+        numpy array: A (runs, 3) array of Ps, alpha and beta.
+        numpy array (bool): Whether each fit converged.
+        numpy array: The root mean square error of each fit.
+    """
+    isValid = np.isfinite(PAR) & np.isfinite(ETR)
+    # Starting guesses: alpha from the steepest initial slope, Ps from the highest ETR, and a little photoinhibition
+    with np.errstate(divide="ignore", invalid="ignore"):
+        initialSlopes = np.where(isValid & (PAR > 0), ETR / PAR, np.nan)
+    alpha0 = np.nan_to_num(np.nanmax(np.where(np.isnan(initialSlopes), -np.inf, initialSlopes), axis=1), nan=1.0, neginf=1.0, posinf=1.0)
+    alpha0 = np.where(alpha0 > 0, alpha0, 1.0)
+    Ps0 = np.maximum(np.max(np.where(isValid, ETR, 0.0), axis=1) * 1.2, 1e-6)
+    logParameters = np.log(np.column_stack([Ps0, alpha0, alpha0 * 1e-3]))
+    logParameters, converged, RMSE = fitBatchLevenbergMarquardt(plattModel, PAR, ETR, logParameters, maxIterations=maxIterations, tolerance=tolerance)
+    return np.exp(logParameters), converged, RMSE
+
+def eilersPeetersModel(PAR, parameters):
+    """The Eilers and Peeters (1988) light curve, ETR = PAR / (a PAR^2 + b PAR + c), and its derivatives with respect
+    to log(a), b and log(c). Working with the logarithms of a and c keeps them positive.
+
+    Args:
+        PAR (numpy array): A (runs, steps) array of light intensities.
+        parameters (numpy array): A (runs, 3) array of log(a), b and log(c).
+
+    Returns:
+        numpy array: The modelled ETR, shaped like PAR.
+        numpy array: The (runs, steps, 3) Jacobian with respect to the parameters.
+    """
+    a = np.exp(parameters[:, 0])[:, None]
+    b = parameters[:, 1][:, None]
+    c = np.exp(parameters[:, 2])[:, None]
+    denominator = a*PAR**2 + b*PAR + c
+    ETR = PAR / denominator
+    dDenominator = -PAR / denominator**2
+    # Chain rule for the log parameters: d/dlog(p) = p * d/dp
+    jacobian = np.stack([dDenominator * PAR**2 * a, dDenominator * PAR, dDenominator * c], axis=-1)
+    return ETR, jacobian
+
+def fitEilersPeetersBatch(PAR, ETR, maxIterations = 500, tolerance = 1e-10):
+    """Fits the Eilers and Peeters (1988) light curve, ETR = PAR / (a PAR^2 + b PAR + c), to many light curves at once.
+    The model is linear in a, b and c when written as PAR/ETR = a PAR^2 + b PAR + c, which gives the starting values,
+    but that fit weights the points by 1/ETR^2, so the curves are then fitted in ETR with fitBatchLevenbergMarquardt.
+    a and c are kept positive.
+
+    Args:
+        PAR (numpy array): A (runs, steps) array of light intensities, padded with NaN.
+        ETR (numpy array): A (runs, steps) array of electron transport rates, padded with NaN.
+        maxIterations (int, optional): The largest number of iterations. Defaults to 500.
+        tolerance (float, optional): A run has converged when its relative change in squared error is below this, or its parameters stop changing. Defaults to 1e-10.
+
+    Returns:
+        numpy array: A (runs, 3) array of a, b and c.
+        numpy array (bool): Whether each fit converged.
+        numpy array: The root mean square error of each fit.
+    """
+    # PAR/ETR is only defined where both are positive
+    isLinearValid = np.isfinite(PAR) & np.isfinite(ETR) & (PAR > 0) & (ETR > 0)
+    safePAR = np.where(isLinearValid, PAR, 0.0)
+    safeETR = np.where(isLinearValid, ETR, 1.0)
+    design = np.stack([safePAR**2, safePAR, np.ones_like(safePAR)], axis=-1) * isLinearValid[:, :, None]
+    target = np.where(isLinearValid, safePAR / safeETR, 0.0)
+    # Batched normal equations, with a tiny ridge so runs with too few points do not make the solve fail
+    normalMatrix = np.einsum("rnk,rnl->rkl", design, design) + 1e-12 * np.eye(3)[None, :, :]
+    a0, b0, c0 = np.linalg.solve(normalMatrix, np.einsum("rnk,rn->rk", design, target)[:, :, None])[:, :, 0].T
+    # Starting values must have positive a and c, and a denominator which stays positive over the measured PAR
+    maxPAR = np.max(np.where(np.isfinite(PAR), PAR, 0.0), axis=1)
+    c0 = np.where(c0 > 0, c0, 1 / np.maximum(np.max(np.where(isLinearValid, safeETR / np.maximum(safePAR, 1e-12), 0.0), axis=1), 1e-6))
+    a0 = np.where(a0 > 0, a0, c0 / np.maximum(maxPAR, 1.0)**2 * 1e-3)
+    b0 = np.where(b0 > -2*np.sqrt(a0*c0), b0, 0.0)
+    parameters, converged, RMSE = fitBatchLevenbergMarquardt(eilersPeetersModel, PAR, ETR, np.column_stack([np.log(a0), b0, np.log(c0)]), maxIterations=maxIterations, tolerance=tolerance)
+    return np.column_stack([np.exp(parameters[:, 0]), parameters[:, 1], np.exp(parameters[:, 2])]), converged, RMSE
+
+def fitLightCurves(PAR, ETR, runOffsets, model = "platt", minSteps = 4):
+    """Estimates the photosynthetic parameters alpha, ETRmax, Ek and beta of every light curve run at once.
+    The runs are stored after each other in PAR and ETR, as in calculateValuesFromArrays. Only runs with at least minSteps
+    different PAR levels are fitted (f.ex. Type: LC runs), the other runs get NaN.
+
+    For the Platt model: ETRmax = Ps (alpha/(alpha+beta)) (beta/(alpha+beta))^(beta/alpha) and Ek = ETRmax/alpha.
+    For the Eilers-Peeters model: alpha = 1/c, ETRmax = 1/(b + 2 sqrt(ac)) and Ek = ETRmax/alpha. The model has no separate
+    photoinhibition parameter (it is part of a), so beta is NaN. Fits without a positive maximum (b + 2 sqrt(ac) <= 0) are not reported.
+    Runs whose fit did not converge get NaN with either model.
+
+    Args:
+        PAR (numpy array): The PAR of every row of every run.
+        ETR (numpy array): The (r)ETR of every row of every run.
+        runOffsets (numpy array of ints): The index of the first row of each run, in increasing order.
+        model (string, optional): "platt" or "eilers-peeters". Defaults to "platt".
+        minSteps (int, optional): The smallest number of different PAR levels a run needs to be fitted. Defaults to 4.
+
+    Returns:
+        pandas DataFrame: One row per run with alpha, ETRmax, Ek, beta and the fit RMSE.
+    """
+    PAR = np.asarray(PAR, dtype=np.float64)
+    ETR = np.asarray(ETR, dtype=np.float64)
+    runOffsets = np.asarray(runOffsets, dtype=np.int64)
+    fit_df = pd.DataFrame(np.nan, index=range(len(runOffsets)), columns=["alpha", "ETRmax", "Ek", "beta", "fitRMSE"])
+    if len(runOffsets) == 0:
+        return fit_df
+    stackedPAR = stackRuns(PAR, runOffsets, len(PAR))
+    stackedETR = stackRuns(ETR, runOffsets, len(ETR))
+    # Count the different PAR levels of each run
+    sortedPAR = np.sort(stackedPAR, axis=1)
+    distinctLevels = np.sum(np.isfinite(sortedPAR) & (np.diff(sortedPAR, axis=1, prepend=-np.inf) > 0), axis=1)
+    isLightCurve = distinctLevels >= minSteps
+    if not isLightCurve.any():
+        return fit_df
+    stackedPAR = stackedPAR[isLightCurve]
+    stackedETR = stackedETR[isLightCurve]
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        if model == "platt":
+            parameters, converged, RMSE = fitPlattBatch(stackedPAR, stackedETR)
+            Ps, alpha, beta = parameters[:, 0], parameters[:, 1], parameters[:, 2]
+            ETRmax = Ps * (alpha/(alpha + beta)) * (beta/(alpha + beta))**(beta/alpha)
+            # Runs that did not converge are not reported
+            alpha, beta, ETRmax = [np.where(converged, values, np.nan) for values in (alpha, beta, ETRmax)]
+        elif model == "eilers-peeters":
+            coefficients, converged, RMSE = fitEilersPeetersBatch(stackedPAR, stackedETR)
+            a, b, c = coefficients[:, 0], coefficients[:, 1], coefficients[:, 2]
+            # a and c are positive, the curve only has a maximum if the denominator stays positive
+            isValidFit = converged & (a > 0) & (c > 0) & (b + 2*np.sqrt(a*c) > 0)
+            alpha = np.where(isValidFit, 1 / c, np.nan)
+            ETRmax = np.where(isValidFit, 1 / (b + 2*np.sqrt(a*c)), np.nan)
+            beta = np.full(len(a), np.nan)
+        else:
+            raise ValueError(f"Unknown light curve model: {model}. Use 'platt' or 'eilers-peeters'")
+        Ek = ETRmax / alpha
+
+    fit_df.loc[isLightCurve, "alpha"] = alpha
+    fit_df.loc[isLightCurve, "ETRmax"] = ETRmax
+    fit_df.loc[isLightCurve, "Ek"] = Ek
+    fit_df.loc[isLightCurve, "beta"] = beta
+    fit_df.loc[isLightCurve, "fitRMSE"] = RMSE
+    return fit_df
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import datetime
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+def newPipelineReport(progressCallback=None, trackMemory=False):
+    """Creates an empty report which mergeData, graphData and the functions they use fill with the wall time, rows and bytes
+    of every stage and every file when it is handed to them as report=. Nothing is measured when no report is given.
+
+    Args:
+        progressCallback (function, optional): Called as progressCallback(event, entry) after every file ("file"), stage ("stage") and quarantined file ("quarantine"), f.ex. printProgress. Defaults to None.
+        trackMemory (bool, optional): Also record the peak memory of every stage with tracemalloc. This slows the processing down. Defaults to False.
+
+    Returns:
+        dict: The report.
+    """
+    if trackMemory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return {"createdAt": datetime.datetime.now().isoformat(timespec="seconds"), "stages": [], "files": [], "quarantinedFiles": [], "progressCallback": progressCallback, "trackMemory": trackMemory}
+
+def notifyProgress(report, event, entry):
+    """Hands a finished file or stage to the progress callback of the report, if it has one."""
+    if report["progressCallback"] is not None:
+        report["progressCallback"](event, entry)
+
+@contextmanager
+def measureStage(report, stageName, experimentID=None):
+    """Measures the wall time (and with trackMemory the peak memory) of the code in the with block as one stage of the report.
+    The block can set "rows" and "bytes" of the yielded stage entry. With report=None nothing is measured.
+
+    Args:
+        report (dict): The report from newPipelineReport, or None.
+        stageName (string): The name of the stage, f.ex. "writeXLSX".
+        experimentID (string, optional): The experiment the stage belongs to. Defaults to None.
+
+    Yields:
+        dict: The stage entry.
+    """
+    stage = {"stage": stageName, "experimentID": experimentID, "seconds": None, "rows": None, "bytes": None}
+    if report is None:
+        yield stage
+        return
+    if report["trackMemory"]:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield stage
+    finally:
+        stage["seconds"] = time.perf_counter() - start
+        if report["trackMemory"]:
+            stage["peakMemoryBytes"] = tracemalloc.get_traced_memory()[1]
+        report["stages"].append(stage)
+        notifyProgress(report, "stage", stage)
+
+def recordFile(report, fileEntry):
+    """Adds the measurements of one file (see measureFileFunction) to the report."""
+    report["files"].append(fileEntry)
+    notifyProgress(report, "file", fileEntry)
+
+def recordQuarantinedFile(report, quarantineEntry):
+    """Adds a file which was left out of the processing (the file name, experiment and reason) to the report."""
+    report["quarantinedFiles"].append(quarantineEntry)
+    notifyProgress(report, "quarantine", quarantineEntry)
+
+def measureFileFunction(fileFunction, fileName, experimentID):
+    """Calls fileFunction(fileName, experimentID) and measures it. Kept at module level so it can run in worker processes
+    (as functools.partial(measureFileFunction, fileFunction)), where the time is measured as well.
+
+    Returns:
+        The result of fileFunction.
+        dict: The file name, experiment, seconds, size of the file in bytes and rows of the (first) data frame in the result.
+    """
+    start = time.perf_counter()
+    result = fileFunction(fileName, experimentID)
+    seconds = time.perf_counter() - start
+    resultItems = result if isinstance(result, tuple) else (result,)
+    # Checked file functions return the result of the file function along with the reason it failed
+    if resultItems and isinstance(resultItems[0], tuple):
+        resultItems = resultItems[0]
+    rows = next((len(item) for item in resultItems if hasattr(item, "columns")), None)
+    return result, {"fileName": fileName, "experimentID": experimentID, "seconds": seconds, "rows": rows, "bytes": os.path.getsize(f"./{experimentID}/{fileName}")}
+
+def getFileSizes(filePaths):
+    """Returns the total size in bytes of the files which exist."""
+    return sum(os.path.getsize(filePath) for filePath in filePaths if os.path.exists(filePath))
+
+def formatProgressLine(event, entry):
+    """Formats a file, stage or quarantine entry as a single log line."""
+    if event == "quarantine":
+        return f"{event:<5} {entry['fileName']:<32} {entry['reason']}"
+    name = entry["fileName"] if event == "file" else entry["stage"]
+    line = f"{event:<5} {name:<32} {entry['seconds']:9.3f} s"
+    if entry.get("rows") is not None:
+        line += f" {entry['rows']:>10} rows"
+    if entry.get("bytes") is not None:
+        line += f" {entry['bytes']:>12} bytes"
+    if entry.get("peakMemoryBytes") is not None:
+        line += f" {entry['peakMemoryBytes']/1e6:10.1f} MB peak"
+    return line
+
+def printProgress(event, entry):
+    """A progress callback which prints a log line for every file and stage."""
+    print(formatProgressLine(event, entry))
+
+def summarizeReport(report, slowFactor=10):
+    """Summarizes the report: the total time of each stage name, and the files which took more than slowFactor times the median file.
+
+    Returns:
+        dict: The report without the callback, with "stageTotals" and "slowFiles" added.
+    """
+    stageTotals = {}
+    for stage in report["stages"]:
+        stageTotals[stage["stage"]] = stageTotals.get(stage["stage"], 0.0) + stage["seconds"]
+    fileSeconds = sorted(fileEntry["seconds"] for fileEntry in report["files"])
+    medianSeconds = fileSeconds[len(fileSeconds)//2] if fileSeconds else 0.0
+    slowFiles = [fileEntry for fileEntry in report["files"] if medianSeconds > 0 and fileEntry["seconds"] > slowFactor*medianSeconds]
+    summary = {key: value for key, value in report.items() if key != "progressCallback"}
+    summary["stageTotals"] = stageTotals
+    summary["medianFileSeconds"] = medianSeconds
+    summary["slowFiles"] = sorted(slowFiles, key=lambda fileEntry: -fileEntry["seconds"])
+    if report["trackMemory"]:
+        summary["peakMemoryBytes"] = max([stage.get("peakMemoryBytes", 0) for stage in report["stages"]], default=0)
+    return summary
+
+def writePipelineReport(report, reportPath):
+    """Saves the summarized report (see summarizeReport) as JSON.
+
+    Args:
+        report (dict): The report from newPipelineReport.
+        reportPath (string): The JSON file to write.
+    """
+    reportDirectory = os.path.dirname(reportPath)
+    if reportDirectory and not os.path.exists(reportDirectory):
+        os.makedirs(reportDirectory)
+    with open(reportPath, "w") as f:
+        json.dump(summarizeReport(report), f, indent=1)
+
+def profileCall(profilePath, function, *args, **kwargs):
+    """Calls function(*args, **kwargs) under cProfile and saves the statistics to profilePath (readable with pstats or snakeviz).
+
+    Returns:
+        The result of the function.
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        profiler.dump_stats(profilePath)
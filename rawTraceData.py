@@ -0,0 +1,255 @@
+import os
+import numpy as np
+import pandas as pd
+import PAMflourometryDataTransfom as dT
+
+def getRawTraceFilesList(experimentID, filesIdentifier = ".csv"):
+    """Gets the raw high frequency fluorescence traces (f.ex. L_230313_144245.csv) in the experimentID directory.
+    The instrument writes these with a lower case ".csv" ending, while the run summaries end with ").CSV".
+
+    Args:
+        experimentID (str): the name of the directory(folder) where your experiment files are kept.
+        filesIdentifier (str, optional): A identifiable string present in the names of the raw trace files. Defaults to ".csv".
+
+    Returns:
+        pandas Series: A series containg the name of all raw trace files
+        string: A string declaring the path of the experiment files
+    """
+    return dT.getCSVfilesList(experimentID, filesIdentifier=filesIdentifier)
+
+def iterateRawTraceChunks(fileName, experimentID, chunkSize = 1000000):
+    """Streams a raw "Time;F;" trace file in chunks, so that traces of any length can be read in bounded memory.
+
+    Args:
+        fileName (str): Name of the raw trace file
+        experimentID (str): Name of the experiment folder
+        chunkSize (int, optional): The number of samples in each chunk. Defaults to 1000000.
+
+    Yields:
+        numpy array (float64): The sample times in seconds. Kept as float64 since float32 can not hold 10 ms steps in recordings longer than a few hours.
+        numpy array (float32): The fluorescence F of each sample.
+    """
+    # Only the first two columns hold data, the trailing ";" creates an empty third column
+    reader = pd.read_csv(f"./{experimentID}/{fileName}", delimiter=";", usecols=[0, 1], dtype={"Time": np.float64, "F": np.float32}, chunksize=chunkSize)
+    with reader:
+        for chunk_df in reader:
+            yield chunk_df["Time"].to_numpy(), chunk_df["F"].to_numpy()
+
+def readRawTrace(fileName, experimentID, chunkSize = 1000000):
+    """Reads a whole raw trace file into two numpy arrays. For very long recordings use convertRawTraceToBinary and loadRawTrace instead.
+
+    Args:
+        fileName (str): Name of the raw trace file
+        experimentID (str): Name of the experiment folder
+        chunkSize (int, optional): The number of samples read at a time. Defaults to 1000000.
+
+    Returns:
+        numpy array (float64): The sample times in seconds.
+        numpy array (float32): The fluorescence F of each sample.
+    """
+    timeChunks = []
+    fluorescenceChunks = []
+    for time_array, F_array in iterateRawTraceChunks(fileName, experimentID, chunkSize=chunkSize):
+        timeChunks.append(time_array)
+        fluorescenceChunks.append(F_array)
+    if not timeChunks:
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float32)
+    return np.concatenate(timeChunks), np.concatenate(fluorescenceChunks)
+
+def getRawTraceBinaryPaths(fileName, experimentID, outputDirectory = None):
+    """Returns the paths of the binary copies of a raw trace file.
+
+    Args:
+        fileName (str): Name of the raw trace file
+        experimentID (str): Name of the experiment folder
+        outputDirectory (str, optional): The directory the binary copies are kept in. Defaults to ./myPAMresults/<experimentID>_rawTraces.
+
+    Returns:
+        string: The path of the float64 time file.
+        string: The path of the float32 fluorescence file.
+    """
+    if outputDirectory is None:
+        outputDirectory = f"./myPAMresults/{experimentID}_rawTraces"
+    traceName = os.path.splitext(fileName)[0]
+    return f"{outputDirectory}/{traceName}.time.f64", f"{outputDirectory}/{traceName}.F.f32"
+
+def convertRawTraceToBinary(fileName, experimentID, outputDirectory = None, chunkSize = 1000000):
+    """Converts a raw trace file into two flat binary files (float64 time and float32 F) chunk by chunk,
+    so the conversion only holds one chunk in memory. The binary copies can then be memory-mapped by loadRawTrace.
+
+    Args:
+        fileName (str): Name of the raw trace file
+        experimentID (str): Name of the experiment folder
+        outputDirectory (str, optional): The directory the binary copies should be written to. Defaults to ./myPAMresults/<experimentID>_rawTraces.
+        chunkSize (int, optional): The number of samples converted at a time. Defaults to 1000000.
+
+    Returns:
+        int: The number of samples written.
+    """
+    timePath, fluorescencePath = getRawTraceBinaryPaths(fileName, experimentID, outputDirectory)
+    dT.createDirectoryIfNotPresent(os.path.dirname(timePath))
+    sampleCount = 0
+    # Append every chunk to the end of temporary files, so an interrupted conversion never leaves a truncated copy which looks up to date
+    with open(timePath + ".tmp", "wb") as timeFile, open(fluorescencePath + ".tmp", "wb") as fluorescenceFile:
+        for time_array, F_array in iterateRawTraceChunks(fileName, experimentID, chunkSize=chunkSize):
+            time_array.tofile(timeFile)
+            F_array.tofile(fluorescenceFile)
+            sampleCount += len(time_array)
+    # loadRawTrace goes by the time file, so it is replaced last
+    os.replace(fluorescencePath + ".tmp", fluorescencePath)
+    os.replace(timePath + ".tmp", timePath)
+    return sampleCount
+
+def loadRawTrace(fileName, experimentID, outputDirectory = None):
+    """Memory-maps the binary copy of a raw trace, converting the trace first if no binary copy exists or it is older than the trace.
+
+    Args:
+        fileName (str): Name of the raw trace file
+        experimentID (str): Name of the experiment folder
+        outputDirectory (str, optional): The directory the binary copies are kept in. Defaults to ./myPAMresults/<experimentID>_rawTraces.
+
+    Returns:
+        numpy memmap (float64): The sample times in seconds.
+        numpy memmap (float32): The fluorescence F of each sample.
+    """
+    timePath, fluorescencePath = getRawTraceBinaryPaths(fileName, experimentID, outputDirectory)
+    tracePath = f"./{experimentID}/{fileName}"
+    # (Re)convert if the binary copy is missing or outdated
+    if not (os.path.exists(timePath) and os.path.exists(fluorescencePath)) or os.path.getmtime(timePath) < os.path.getmtime(tracePath):
+        convertRawTraceToBinary(fileName, experimentID, outputDirectory)
+    # np.memmap can not map empty files
+    if os.path.getsize(timePath) == 0:
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float32)
+    return np.memmap(timePath, dtype=np.float64, mode="r"), np.memmap(fluorescencePath, dtype=np.float32, mode="r")
+
+def linkRawTracesToRuns(experimentID):
+    """Links each run summary file to its raw trace by the name in its "File: *.PWS" footer
+    (f.ex. File: L_230313_144245.PWS belongs to L_230313_144245.csv).
+
+    Args:
+        experimentID (str): Name of the experiment folder
+
+    Returns:
+        dict: The raw trace file name for each run summary file name. Runs without a raw trace in the folder are left out.
+    """
+    rawTraceFiles, experimentPath = getRawTraceFilesList(experimentID)
+    # Look up raw traces by their name without the file ending
+    rawTraceByName = {os.path.splitext(traceFile)[0]: traceFile for traceFile in rawTraceFiles}
+    runFiles, experimentPath = dT.getCSVfilesList(experimentID)
+    runToTrace = {}
+    for runFile in runFiles:
+        listOfSampleNames, runMetadata, PAMdata_df = dT.readPAMfile(runFile, experimentID)
+        if runMetadata["pwsFile"] is None:
+            continue
+        traceName = os.path.splitext(runMetadata["pwsFile"])[0]
+        if traceName in rawTraceByName:
+            runToTrace[runFile] = rawTraceByName[traceName]
+    return runToTrace
+
+def movingAverage(values, windowSamples):
+    """Calculates the moving average of an array with a cumulative sum, so the cost does not grow with the window size.
+
+    Args:
+        values (numpy array): The values to average.
+        windowSamples (int): The number of samples in each window.
+
+    Returns:
+        numpy array (float64): The average of values[i:i+windowSamples] at position i, len(values) - windowSamples + 1 long.
+    """
+    cumulative = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    return (cumulative[windowSamples:] - cumulative[:-windowSamples]) / windowSamples
+
+def detectSaturationPulses(time_array, F_array, riseLag = 0.03, minRelativeRise = 0.03, minAbsoluteRise = 0.01, pulseWindow = 0.8, baselineWindow = 0.2, smoothingWindow = 0.05, returnWindow = 2.0, minReturnFraction = 0.5):
+    """Finds the saturating pulses in a raw fluorescence trace and extracts F, Fm' and ~Fo' for each of them.
+    All steps work on whole arrays, so multi-million sample traces are handled without a loop over the samples.
+
+    A pulse starts where F rises by more than minRelativeRise (and minAbsoluteRise) within riseLag seconds.
+    F is the mean of the baselineWindow seconds before the pulse, and Fm' is the highest smoothingWindow-second
+    average within pulseWindow seconds after the start of the pulse. Rises where F does not fall back by at least
+    minReturnFraction of the pulse height within returnWindow seconds after the pulse window (f.ex. steps in actinic
+    light) are not counted as pulses. The first pulse is taken as the dark adapted
+    pulse giving Fo and Fm, which are used to calculate ~Fo' = Fo / ((Fm - Fo)/Fm + Fo/Fm') (Oxborough and Baker, 1997).
+
+    Args:
+        time_array (numpy array): The sample times in seconds.
+        F_array (numpy array): The fluorescence F of each sample.
+        riseLag (float, optional): The time in seconds over which the rise at the start of a pulse is measured. Defaults to 0.03.
+        minRelativeRise (float, optional): The smallest rise, relative to F before the pulse, that counts as a pulse. Defaults to 0.03.
+        minAbsoluteRise (float, optional): The smallest absolute rise in F that counts as a pulse. Defaults to 0.01.
+        pulseWindow (float, optional): The length in seconds of the window after the start of the pulse where Fm' is searched for. Defaults to 0.8.
+        baselineWindow (float, optional): The length in seconds of the window before the pulse F is averaged over. Defaults to 0.2.
+        smoothingWindow (float, optional): The length in seconds of the moving average used to find Fm', at most pulseWindow. Defaults to 0.05.
+        returnWindow (float, optional): The length in seconds of the window after the pulse window where F must fall back. Defaults to 2.0.
+        minReturnFraction (float, optional): How much of the pulse height F must fall back after the pulse window. Defaults to 0.5.
+
+    Returns:
+        pandas DataFrame: One row per pulse with the columns t (start of the pulse in seconds), F, Fm' and ~Fo'.
+    """
+    time_array = np.asarray(time_array, dtype=np.float64)
+    F_array = np.asarray(F_array, dtype=np.float64)
+    if len(time_array) < 2:
+        return pd.DataFrame(columns=["t", "F", "Fm'", "~Fo'"])
+    # Convert the windows from seconds to samples using the median sampling interval
+    sampleInterval = np.median(np.diff(time_array))
+    lagSamples = max(1, int(round(riseLag / sampleInterval)))
+    pulseSamples = max(1, int(round(pulseWindow / sampleInterval)))
+    baselineSamples = max(1, int(round(baselineWindow / sampleInterval)))
+    # The moving average can not be longer than the window it is searched in
+    smoothingSamples = min(pulseSamples, max(1, int(round(smoothingWindow / sampleInterval))))
+    returnSamples = max(1, int(round(returnWindow / sampleInterval)))
+
+    # Find every sample followed by a steep rise
+    rise = F_array[lagSamples:] - F_array[:-lagSamples]
+    candidates = np.flatnonzero((rise > minRelativeRise * F_array[:-lagSamples]) & (rise > minAbsoluteRise))
+    # Keep the first candidate of each pulse, i.e. those more than a pulse window after the previous candidate
+    onsets = candidates[np.diff(candidates, prepend=-pulseSamples - 1) > pulseSamples]
+    # Pulses need a full baseline window before them and a full pulse window after them
+    onsets = onsets[(onsets >= baselineSamples) & (onsets + pulseSamples < len(F_array))]
+
+    # F: the mean of the baseline window before each pulse
+    cumulative = np.concatenate(([0.0], np.cumsum(F_array)))
+    steadyState_F = (cumulative[onsets] - cumulative[onsets - baselineSamples]) / baselineSamples
+    # Fm': the highest smoothed value within each pulse window, found by indexing all windows at once
+    smoothed_F = movingAverage(F_array, smoothingSamples)
+    windowIndexes = onsets[:, None] + np.arange(pulseSamples - smoothingSamples + 1)[None, :]
+    Fm_prime = smoothed_F[np.minimum(windowIndexes, len(smoothed_F) - 1)].max(axis=1)
+    # Only keep rises where F falls back after the pulse window, the return window is cut short at the end of the trace
+    returnIndexes = onsets[:, None] + pulseSamples + np.arange(returnSamples)[None, :]
+    after_F = F_array[np.minimum(returnIndexes, len(F_array) - 1)].min(axis=1)
+    isPulse = (Fm_prime - after_F) > minReturnFraction * (Fm_prime - steadyState_F)
+    onsets, steadyState_F, Fm_prime = onsets[isPulse], steadyState_F[isPulse], Fm_prime[isPulse]
+    if len(onsets) == 0:
+        return pd.DataFrame(columns=["t", "F", "Fm'", "~Fo'"])
+    # The first pulse is given in darkness and provides Fo and Fm
+    Fo = steadyState_F[0]
+    Fm = Fm_prime[0]
+    Fo_prime = Fo / ((Fm - Fo) / Fm + Fo / Fm_prime)
+
+    return pd.DataFrame({"t": time_array[onsets], "F": steadyState_F, "Fm'": Fm_prime, "~Fo'": Fo_prime})
+
+def recalculateRunFromRawTrace(runFileName, experimentID, **pulseWindows):
+    """Recalculates NPQown, PSII', qP and rETR for a run from its raw trace instead of the instrument summary.
+    The pulses are found with detectSaturationPulses and the PAR of each pulse is taken from the summary row closest in time.
+
+    Args:
+        runFileName (str): Name of the run summary file (f.ex. 20230313(2).CSV)
+        experimentID (str): Name of the experiment folder
+        **pulseWindows: Keyword arguments passed on to detectSaturationPulses (f.ex. pulseWindow=0.6).
+
+    Returns:
+        pandas DataFrame: One row per pulse with t, PAR, F, Fm', ~Fo', NPQown, PSII', qP and rETR.
+        pandas Series: A pandas Series containing the maximal valuse for: Fm, NPQ, Fo, and PSII.
+    """
+    listOfSampleNames, runMetadata, PAMdata_df = dT.readPAMfile(runFileName, experimentID)
+    if runMetadata["pwsFile"] is None:
+        raise ValueError(f"./{experimentID}/{runFileName} has no File: *.PWS footer to link it to a raw trace")
+    traceFileName = os.path.splitext(runMetadata["pwsFile"])[0] + ".csv"
+    time_array, F_array = loadRawTrace(traceFileName, experimentID)
+    pulses_df = detectSaturationPulses(time_array, F_array, **pulseWindows)
+    if len(pulses_df) == 0 or len(PAMdata_df) == 0:
+        raise ValueError(f"No saturating pulses could be matched for ./{experimentID}/{runFileName}")
+    # Take the PAR from the summary row closest in time to each pulse. The summary t may be absolute, so align its first row with the first (dark) pulse
+    summaryTimes = (PAMdata_df["t"] - PAMdata_df["t"].iloc[0]).to_numpy(dtype=np.float64) + pulses_df["t"].iloc[0]
+    closestRow = np.abs(pulses_df["t"].to_numpy()[:, None] - summaryTimes[None, :]).argmin(axis=1)
+    pulses_df.insert(1, "PAR", PAMdata_df["PAR"].to_numpy()[closestRow])
+    return dT.calculateValuesAndInject(pulses_df, listOfSampleNames)
@@ -0,0 +1,59 @@
+"""Builds small experiments from the run in 20230314 for the tests which process whole experiment directories."""
+import os
+import sys
+
+import pytest
+
+repositoryDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, repositoryDirectory)
+
+with open(os.path.join(repositoryDirectory, "20230314", "20230314_1(1).CSV"), "r") as f:
+    runText = f.read()
+
+
+def writeRun(experimentDirectory, fileName, text):
+    with open(os.path.join(experimentDirectory, fileName), "w") as f:
+        f.write(text)
+
+
+def goodRunText(sampleName):
+    return runText.replace("WT 1.1.1", sampleName, 1)
+
+
+def cutOffRunText():
+    """A run whose write was interrupted halfway through its last data row, before the File: footer."""
+    lastRowStart = runText.rindex("3887945846;")
+    return runText[:lastRowStart + 20]
+
+
+def headerlessRunText():
+    return "\n".join(line for line in runText.split("\n") if not line.startswith('"t"'))
+
+
+def cutOffTimeRunText():
+    return runText.replace(";08:51:26;", ";08:51;", 1)
+
+
+# The reason every bad run file of badFilesExperiment is quarantined for
+expectedFailureReasons = {
+    "exp(3).CSV": "the data is missing the column(s) No., PAR, Fm', ~Fo' (empty or cut off rows)",
+    "exp(4).CSV": "the file does not contain a PAM column header",
+    "exp(5).CSV": "the file can not be read",
+    "exp(6).CSV": "the Date/Time of 1 row(s) can not be read (f.ex. 14.03.23 08:51)",
+}
+
+
+@pytest.fixture
+def badFilesExperiment(tmp_path, monkeypatch):
+    """An experiment "exp" in a temporary working directory with two good runs, a cut off run, a run without column header,
+    a file which is not text and a run with a cut off time. Returns the names of the good runs."""
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("exp")
+    writeRun("exp", "exp(1).CSV", goodRunText("WT 1.1.1"))
+    writeRun("exp", "exp(2).CSV", goodRunText("LHCX1g1 2.1.1"))
+    writeRun("exp", "exp(3).CSV", cutOffRunText())
+    writeRun("exp", "exp(4).CSV", headerlessRunText())
+    with open(os.path.join("exp", "exp(5).CSV"), "wb") as f:
+        f.write(b"\xff\xfe\x00\x81 not a run file \x9d")
+    writeRun("exp", "exp(6).CSV", cutOffTimeRunText())
+    return ["exp(1).CSV", "exp(2).CSV"]
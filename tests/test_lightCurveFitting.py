@@ -0,0 +1,75 @@
+"""Checks the batched light curve fits against curves with known parameters.
+
+Run from the repository root:
+    python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import lightCurveFitting
+
+# The light steps of LightCurve_Marianne.lcp
+protocolPAR = np.array([0, 5, 8, 19, 32, 58, 124, 178, 245, 351, 470, 600, 754, 906, 1314], dtype=np.float64)
+runCount = 500
+
+
+def stackedCurves(ETR):
+    """Returns PAR, ETR and the run offsets of (runs, steps) curves stored after each other, as fitLightCurves takes them."""
+    PAR = np.tile(protocolPAR, (len(ETR), 1))
+    return PAR.ravel(), ETR.ravel(), np.arange(len(ETR)) * len(protocolPAR)
+
+
+def plattCurves(rng):
+    Ps = rng.uniform(20, 40, runCount)
+    alpha = rng.uniform(0.3, 0.8, runCount)
+    beta = rng.uniform(0.0, 0.05, runCount)
+    x = protocolPAR[None, :] / Ps[:, None]
+    ETR = Ps[:, None] * (1 - np.exp(-alpha[:, None] * x)) * np.exp(-beta[:, None] * x)
+    ETRmax = Ps * (alpha/(alpha + beta)) * (beta/(alpha + beta))**(beta/alpha)
+    return ETR, alpha, ETRmax
+
+
+def test_plattFitRecoversKnownParameters():
+    ETR, alpha, ETRmax = plattCurves(np.random.default_rng(0))
+    fit_df = lightCurveFitting.fitLightCurves(*stackedCurves(ETR), model="platt")
+    np.testing.assert_allclose(fit_df["alpha"], alpha, rtol=1e-6)
+    np.testing.assert_allclose(fit_df["ETRmax"], ETRmax, rtol=1e-6)
+    np.testing.assert_allclose(fit_df["Ek"], ETRmax / alpha, rtol=1e-6)
+
+
+def test_eilersPeetersFitRecoversKnownParameters():
+    rng = np.random.default_rng(1)
+    a = rng.uniform(1e-5, 5e-5, runCount)
+    b = rng.uniform(0.005, 0.03, runCount)
+    c = rng.uniform(1.2, 3.0, runCount)
+    ETR = protocolPAR[None, :] / (a[:, None]*protocolPAR[None, :]**2 + b[:, None]*protocolPAR[None, :] + c[:, None])
+    fit_df = lightCurveFitting.fitLightCurves(*stackedCurves(ETR), model="eilers-peeters")
+    np.testing.assert_allclose(fit_df["alpha"], 1 / c, rtol=1e-6)
+    np.testing.assert_allclose(fit_df["ETRmax"], 1 / (b + 2*np.sqrt(a*c)), rtol=1e-6)
+    assert fit_df["beta"].isna().all()
+
+
+def test_eilersPeetersFitOfPlattCurvesStaysClose():
+    # The models differ in shape, but the fitted maximum must stay near the true one and never be negative
+    ETR, alpha, ETRmax = plattCurves(np.random.default_rng(2))
+    fit_df = lightCurveFitting.fitLightCurves(*stackedCurves(ETR), model="eilers-peeters")
+    assert fit_df["ETRmax"].notna().all()
+    assert (fit_df["ETRmax"] > 0).all()
+    assert (np.abs(fit_df["ETRmax"] / ETRmax - 1) < 0.2).all()
+
+
+def test_runsWithoutLightCurveAreNotFitted():
+    PAR = np.concatenate([protocolPAR, np.full(5, 100.0)])
+    ETR = np.concatenate([protocolPAR * 0.1, np.full(5, 10.0)])
+    fit_df = lightCurveFitting.fitLightCurves(PAR, ETR, [0, len(protocolPAR)], model="platt")
+    assert fit_df.loc[0].notna()[["alpha", "ETRmax", "Ek"]].all()
+    assert fit_df.loc[1].isna().all()
+
+
+def test_unknownModelRaises():
+    with pytest.raises(ValueError):
+        lightCurveFitting.fitLightCurves(*stackedCurves(plattCurves(np.random.default_rng(3))[0]), model="webb")
@@ -0,0 +1,93 @@
+"""Checks that bad run files are quarantined with their reason, the same way with and without the run cache,
+and that an interrupted batch run continues from its checkpoint.
+
+Run from the repository root:
+    python -m pytest tests
+"""
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import PAMflourometryDataTransfom as dT
+import consoleInterface
+from conftest import expectedFailureReasons, goodRunText, writeRun
+
+
+def readQuarantineList(experimentName):
+    with open(f"myPAMresults/{experimentName}_quarantine.json", "r") as f:
+        return json.load(f)
+
+
+def assertExpectedReasons(quarantinedFiles):
+    assert sorted(quarantinedFiles) == sorted(expectedFailureReasons)
+    for fileName, reason in expectedFailureReasons.items():
+        assert quarantinedFiles[fileName].startswith(reason)
+
+
+def test_badFilesAreQuarantinedWithTheirReason(badFilesExperiment):
+    dT.mergeData("exp", False, True, skipBadFiles=True)
+    quarantineList = readQuarantineList("exp")
+    assert quarantineList["experimentID"] == "exp"
+    assertExpectedReasons(quarantineList["files"])
+    mainData_df = pd.read_csv("myPAMresults/exp_mainData.CSV")
+    assert sorted(mainData_df["sampleName"].unique()) == ["LHCX1g1 2.1.1", "WT 1.1.1"]
+
+
+def test_badFilesStopTheMergeWithoutSkipBadFiles(badFilesExperiment):
+    with pytest.raises(Exception):
+        dT.mergeData("exp", False, True)
+    assert not os.path.exists("myPAMresults/exp_quarantine.json")
+
+
+def test_cachedAndUncachedMergesAgree(badFilesExperiment):
+    dT.mergeData("exp", False, True, skipBadFiles=True, csvFileNames=["uncachedMain.CSV", "uncachedMax.CSV"])
+    uncachedQuarantine = readQuarantineList("exp")
+    # The second cached merge takes the runs and the reasons from the cache
+    for cachedRun in range(2):
+        dT.mergeData("exp", False, True, skipBadFiles=True, useCache=True, csvFileNames=["cachedMain.CSV", "cachedMax.CSV"])
+        assert readQuarantineList("exp") == uncachedQuarantine
+        pd.testing.assert_frame_equal(pd.read_csv("myPAMresults/cachedMain.CSV"), pd.read_csv("myPAMresults/uncachedMain.CSV"))
+        pd.testing.assert_frame_equal(pd.read_csv("myPAMresults/cachedMax.CSV"), pd.read_csv("myPAMresults/uncachedMax.CSV"))
+
+
+def test_quarantineListIsSavedWhenEveryFileIsBad(badFilesExperiment):
+    for fileName in badFilesExperiment:
+        os.remove(os.path.join("exp", fileName))
+    with pytest.raises(ValueError, match="None of the 4 run files of exp can be processed"):
+        dT.graphData("exp", outputPath="plots/exp.png", skipBadFiles=True)
+    assertExpectedReasons(readQuarantineList("exp")["files"])
+
+
+def test_commandLineSavesQuarantineListForFailedExperiment(badFilesExperiment, capsys):
+    for fileName in badFilesExperiment:
+        os.remove(os.path.join("exp", fileName))
+    exitStatus = consoleInterface.runCommandLine(["process", "exp", "--format", "csv", "--plot", "--plot-dir", "plots", "--skip-bad-files"])
+    assert exitStatus == 1
+    assert "Failed exp: ValueError: None of the 4 run files of exp can be processed" in capsys.readouterr().out
+    assertExpectedReasons(readQuarantineList("exp")["files"])
+
+
+def test_checkpointSkipsFinishedUnchangedExperiments(badFilesExperiment, capsys):
+    os.mkdir("exp2")
+    writeRun("exp2", "exp2(1).CSV", goodRunText("WT 3.1.1"))
+    arguments = ["process", "exp", "exp2", "--format", "csv", "--skip-bad-files", "--checkpoint", "myPAMresults/checkpoint.json"]
+    assert consoleInterface.runCommandLine(arguments) == 0
+    assert "Processing exp2" in capsys.readouterr().out
+    with open("myPAMresults/checkpoint.json", "r") as f:
+        assert sorted(json.load(f)["experiments"]) == ["exp", "exp2"]
+
+    # Run again after a run file of exp2 changed: only exp2 is processed
+    writeRun("exp2", "exp2(2).CSV", goodRunText("WT 3.1.2"))
+    assert consoleInterface.runCommandLine(arguments) == 0
+    output = capsys.readouterr().out
+    assert "Skipping exp: finished in an earlier run and unchanged since" in output
+    assert "Processing exp2" in output
+    assert sorted(pd.read_csv("myPAMresults/exp2_mainData.CSV")["sampleName"].unique()) == ["WT 3.1.1", "WT 3.1.2"]
+
+    # Options which change the results make the checkpoint invalid
+    assert consoleInterface.runCommandLine(arguments + ["--light-curve", "platt"]) == 0
+    output = capsys.readouterr().out
+    assert "Not using myPAMresults/checkpoint.json: it was made with other options" in output
+    assert "Processing exp\n" in output
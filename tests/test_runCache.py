@@ -0,0 +1,103 @@
+"""Checks which run files the run cache processes again: only new and changed files (by size, modification time and content hash),
+and every file after the cache format changed.
+
+Run from the repository root:
+    python -m pytest tests
+"""
+import json
+import os
+
+import pandas as pd
+
+import PAMflourometryDataTransfom as dT
+import pipelineReport
+from conftest import expectedFailureReasons, goodRunText, writeRun
+
+
+def processCached(quarantine=None):
+    """Processes the experiment "exp" with the cache in "cache". Returns the runs, the names of the files which were read and the quarantine."""
+    report = pipelineReport.newPipelineReport()
+    if quarantine is None:
+        quarantine = {}
+    runs = dT.processExperimentFiles("exp", cacheDirectory="cache", report=report, quarantine=quarantine)
+    return runs, sorted(fileEntry["fileName"] for fileEntry in report["files"]), quarantine
+
+
+def assertSameRuns(runs, expectedRuns):
+    assert len(runs) == len(expectedRuns)
+    for (sampleNames, calculatedPAMdata_df, calcValues), (expectedSampleNames, expectedPAMdata_df, expectedCalcValues) in zip(runs, expectedRuns):
+        assert sampleNames == expectedSampleNames
+        pd.testing.assert_frame_equal(calculatedPAMdata_df, expectedPAMdata_df)
+        pd.testing.assert_series_equal(calcValues, expectedCalcValues)
+
+
+def test_unchangedFilesAreNotReadAgain(badFilesExperiment):
+    uncachedQuarantine = {}
+    uncachedRuns = dT.processExperimentFiles("exp", quarantine=uncachedQuarantine)
+    firstRuns, firstReadFiles, firstQuarantine = processCached()
+    assert set(badFilesExperiment) <= set(firstReadFiles)
+    assert firstQuarantine == uncachedQuarantine
+    assertSameRuns(firstRuns, uncachedRuns)
+
+    # The runs and the reasons of the failed files both come from the cache
+    cachedRuns, readFiles, cachedQuarantine = processCached()
+    assert readFiles == []
+    assert cachedQuarantine == uncachedQuarantine
+    assertSameRuns(cachedRuns, uncachedRuns)
+    with open("cache/index.json", "r") as f:
+        cacheIndex = json.load(f)
+    assert sorted(fileName for fileName, entry in cacheIndex.items() if "failure" in entry) == sorted(expectedFailureReasons)
+
+
+def test_touchedFileWithSameContentIsNotReadAgain(badFilesExperiment):
+    processCached()
+    filePath = os.path.join("exp", badFilesExperiment[0])
+    os.utime(filePath, (os.path.getatime(filePath), os.path.getmtime(filePath) + 10))
+    runs, readFiles, quarantine = processCached()
+    assert readFiles == []
+    assert len(runs) == len(badFilesExperiment)
+
+
+def test_changedFilesAreReadAgain(badFilesExperiment):
+    processCached()
+    # The same size but other content
+    writeRun("exp", badFilesExperiment[0], goodRunText("WT 1.1.2"))
+    runs, readFiles, quarantine = processCached()
+    assert readFiles == [badFilesExperiment[0]]
+    assert ["WT 1.1.2"] in [sampleNames for sampleNames, calculatedPAMdata_df, calcValues in runs]
+
+    # Another size
+    writeRun("exp", badFilesExperiment[1], goodRunText("LHCX1g1 2.1.10"))
+    runs, readFiles, quarantine = processCached()
+    assert readFiles == [badFilesExperiment[1]]
+    assert ["LHCX1g1 2.1.10"] in [sampleNames for sampleNames, calculatedPAMdata_df, calcValues in runs]
+
+
+def test_fixedFileLeavesTheQuarantine(badFilesExperiment):
+    processCached()
+    writeRun("exp", "exp(4).CSV", goodRunText("WT 1.1.3"))
+    runs, readFiles, quarantine = processCached()
+    assert readFiles == ["exp(4).CSV"]
+    assert "exp(4).CSV" not in quarantine
+    assert sorted(sampleNames for sampleNames, calculatedPAMdata_df, calcValues in runs) == [["LHCX1g1 2.1.1"], ["WT 1.1.1"], ["WT 1.1.3"]]
+
+
+def test_removedFilesAreDroppedFromTheCache(badFilesExperiment):
+    processCached()
+    os.remove(os.path.join("exp", badFilesExperiment[1]))
+    runs, readFiles, quarantine = processCached()
+    assert readFiles == []
+    assert len(runs) == 1
+    with open("cache/index.json", "r") as f:
+        cacheIndex = json.load(f)
+    assert badFilesExperiment[1] not in cacheIndex
+    assert len([fileName for fileName in os.listdir("cache") if fileName.endswith(".pkl")]) == 1
+
+
+def test_otherCacheFormatIsProcessedAgain(badFilesExperiment, monkeypatch):
+    firstRuns, firstReadFiles, firstQuarantine = processCached()
+    monkeypatch.setattr(dT, "runCacheFormat", dT.runCacheFormat + 1)
+    runs, readFiles, quarantine = processCached()
+    assert readFiles == firstReadFiles
+    assert quarantine == firstQuarantine
+    assertSameRuns(runs, firstRuns)